@@ -0,0 +1,257 @@
+import csv
+import os
+import pickle
+import tempfile
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from os.path import abspath, dirname, exists, join, relpath
+
+import numpy as np
+
+# Reads the [Common Infos] and [Binary Infos] sections of BrainVision .vhdr/.vmrk files by
+# key instead of by line number. Only the start of a file is read (the sections come before
+# the channel and marker lists), and parsed headers are cached across runs by (path,
+# mtime, size) so unchanged files are not opened again.
+#
+# The .eeg payload described by a header can be scanned for unusable recordings (all
+# zero, flat or saturated channels, long runs of zeros) in one chunked pass over a numpy
+# memmap; the per-file results are kept in a CSV record next to the tracker so a file is
+# only scanned again when it changes.
+
+Header = namedtuple("Header", ["data_file", "marker_file", "channels", "sampling_interval", "binary_format", "data_format", "orientation"])
+
+SECTIONS = {"Common Infos", "Binary Infos"}
+KEYS = {"DataFile": "data_file", "MarkerFile": "marker_file", "NumberOfChannels": "channels",
+        "SamplingInterval": "sampling_interval", "BinaryFormat": "binary_format",
+        "DataFormat": "data_format", "DataOrientation": "orientation"}
+# little-endian sample type for each BinaryFormat
+SAMPLE_TYPES = {"INT_16": np.dtype("<i2"), "UINT_16": np.dtype("<u2"), "INT_32": np.dtype("<i4"), "IEEE_FLOAT_32": np.dtype("<f4")}
+CACHE_NAME = "brainvision-headers.pkl"
+CACHE_VERSION = 2 # bump whenever Header changes
+_max_bytes = 64 * 1024
+
+def _number(value, kind):
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        return None
+
+def read_header(path):
+    # Header of a .vhdr or .vmrk, fields missing from the file are None
+    values = dict()
+    section = None
+    with open(path, "rb") as f:
+        for line in f.read(_max_bytes).decode("utf-8", "replace").splitlines():
+            line = line.strip()
+            if line.startswith("[") and line.endswith("]"):
+                if section in SECTIONS and line[1:-1] not in SECTIONS:
+                    break # past the sections we need
+                section = line[1:-1]
+            elif section in SECTIONS and "=" in line and not line.startswith(";"):
+                key, value = line.split("=", 1)
+                if key.strip() in KEYS:
+                    values[KEYS[key.strip()]] = value.strip()
+    return Header(values.get("data_file"), values.get("marker_file"), _number(values.get("channels"), int),
+                  _number(values.get("sampling_interval"), float), values.get("binary_format"),
+                  values.get("data_format"), values.get("orientation"))
+
+def binary_layout(header):
+    # (channels, sample dtype) when the header describes a binary file that can be read, else None
+    if header.data_format not in (None, "BINARY") or header.binary_format not in SAMPLE_TYPES:
+        return None
+    if header.channels is None or header.channels < 1:
+        return None
+    return header.channels, SAMPLE_TYPES[header.binary_format]
+
+def size_problem(header, eeg_size):
+    # None when eeg_size bytes hold a whole number of samples for every channel, otherwise why not
+    layout = binary_layout(header)
+    if layout is None:
+        return None # not enough in the header to tell
+    frame = layout[0] * layout[1].itemsize
+    if eeg_size % frame != 0:
+        return str(eeg_size) + " bytes is not a whole number of " + str(header.channels) + "-channel " + header.binary_format + " samples (" + str(frame) + " bytes each)"
+    return None
+
+class HeaderCache:
+    def __init__(self, cache_dir):
+        self.path = join(cache_dir, CACHE_NAME)
+        self.entries = dict() # path -> (mtime_ns, size, Header)
+        self.read = 0 # files opened this run
+        self._changed = False
+        try:
+            with open(self.path, "rb") as f:
+                version, entries = pickle.load(f)
+            if version == CACHE_VERSION:
+                self.entries = entries
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, TypeError, ValueError):
+            self.entries = dict()
+
+    def header(self, path):
+        st = os.stat(path)
+        known = self.entries.get(path)
+        if known is not None and known[:2] == (st.st_mtime_ns, st.st_size):
+            return known[2]
+        header = read_header(path)
+        self.entries[path] = (st.st_mtime_ns, st.st_size, header)
+        self.read += 1
+        self._changed = True
+        return header
+
+    def save(self):
+        if not self._changed:
+            return
+        self.entries = {path: entry for path, entry in self.entries.items() if os.path.exists(path)}
+        cache_dir = os.path.dirname(self.path)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix="." + CACHE_NAME + ".")
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump((CACHE_VERSION, self.entries), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass # headers are just read again next time
+
+# a recording is flagged when a channel is clipped in more than CLIP_FRACTION of its samples
+# or holds exact zeros for longer than DROPOUT_SECONDS; flat (zero variance) channels always are
+CLIP_FRACTION = 0.01
+DROPOUT_SECONDS = 1.0
+SIGNAL_RECORD_NAME = "eeg-signal-summary.csv"
+SIGNAL_FIELDS = ["path", "size", "mtime_ns", "channels", "samples", "min_variance", "max_clipped_fraction", "longest_dropout_s", "problems", "version"]
+SIGNAL_VERSION = 2 # bump whenever signal_summary changes, older rows are scanned again
+_chunk_frames = 16384
+
+SignalSummary = namedtuple("SignalSummary", ["channels", "samples", "min_variance", "max_clipped_fraction", "longest_dropout_s", "problems"])
+
+def _clip_bounds(dtype):
+    # (lower, upper) saturation values; unsigned samples rest at 0, which the dropout check
+    # already covers, so only their upper bound counts as clipping
+    if dtype.kind == "i":
+        return np.iinfo(dtype).min, np.iinfo(dtype).max
+    if dtype.kind == "u":
+        return None, np.iinfo(dtype).max
+    return None # float samples have no fixed range to saturate at
+
+def signal_summary(eeg_path, header):
+    # per-channel variance, clipping fraction and longest run of zeros in one chunked pass
+    channels, dtype = binary_layout(header)
+    frames = os.path.getsize(eeg_path) // (channels * dtype.itemsize)
+    if frames == 0:
+        return SignalSummary(channels, 0, 0.0, 0.0, 0.0, "no samples")
+    if header.orientation == "VECTORIZED":
+        data = np.memmap(eeg_path, dtype=dtype, mode="r", shape=(channels, frames)).T
+    else:
+        data = np.memmap(eeg_path, dtype=dtype, mode="r", shape=(frames, channels))
+    bounds = _clip_bounds(dtype)
+    count = 0
+    mean = np.zeros(channels)
+    m2 = np.zeros(channels)
+    clipped = np.zeros(channels, dtype="int64")
+    run = np.zeros(channels, dtype="int64") # zeros at the end of the previous chunk
+    longest = np.zeros(channels, dtype="int64")
+    all_zero = True
+    for start in range(0, frames, _chunk_frames):
+        block = np.asarray(data[start:start + _chunk_frames], dtype="float64")
+        n = len(block)
+        # chunk mean and sum of squares merged into the running ones (Chan et al.)
+        block_mean = block.mean(axis=0)
+        block_m2 = ((block - block_mean) ** 2).sum(axis=0)
+        delta = block_mean - mean
+        mean = mean + delta * n / (count + n)
+        m2 = m2 + block_m2 + delta ** 2 * count * n / (count + n)
+        count += n
+        if bounds is not None:
+            saturated = block >= bounds[1]
+            if bounds[0] is not None:
+                saturated |= block <= bounds[0]
+            clipped += saturated.sum(axis=0)
+        zero = block == 0
+        all_zero = all_zero and bool(zero.all())
+        # zeros since the last nonzero sample of each channel, carried over from the previous chunk
+        position = np.arange(1, n + 1)[:, None]
+        last_nonzero = np.maximum.accumulate(np.where(zero, 0, position), axis=0)
+        runs = position - last_nonzero
+        runs = np.where(last_nonzero == 0, runs + run, runs)
+        longest = np.maximum(longest, runs.max(axis=0))
+        run = runs[-1]
+    del data
+    variance = m2 / count
+    clipped_fraction = clipped / count
+    seconds = None if header.sampling_interval is None else header.sampling_interval / 1e6
+    longest_dropout = float(longest.max()) * seconds if seconds is not None else None
+    problems = []
+    if all_zero:
+        problems.append("all samples are zero")
+    else:
+        flat = [str(ch + 1) for ch in np.flatnonzero(variance == 0)]
+        if len(flat) > 0:
+            problems.append("flat channels " + ",".join(flat))
+        saturated = [str(ch + 1) for ch in np.flatnonzero(clipped_fraction > CLIP_FRACTION)]
+        if len(saturated) > 0:
+            problems.append("clipped channels " + ",".join(saturated) + " (" + "{:.1%}".format(clipped_fraction.max()) + " of samples)")
+        if longest_dropout is not None and longest_dropout > DROPOUT_SECONDS:
+            problems.append("zeros for " + "{:.1f}".format(longest_dropout) + " s on channel " + str(int(np.argmax(longest)) + 1))
+    return SignalSummary(channels, frames, float(variance.min()), float(clipped_fraction.max()),
+                         longest_dropout if longest_dropout is not None else "", "; ".join(problems))
+
+def signal_record_path(dataset):
+    return join(dataset, "data-monitoring", SIGNAL_RECORD_NAME)
+
+class SignalRecord:
+    # SignalSummary of every scanned .eeg, rescanned only when its size or mtime changes
+    def __init__(self, dataset, jobs=None):
+        self.dataset = dataset
+        self.path = signal_record_path(dataset)
+        self.jobs = jobs or min(4, os.cpu_count() or 1)
+        self.entries = dict() # path relative to dataset -> (size, mtime_ns, SignalSummary)
+        self.scanned = 0 # files read this run
+        self._seen = set()
+        try:
+            with open(self.path, newline="") as f:
+                for row in csv.DictReader(f):
+                    if row.get("version") != str(SIGNAL_VERSION):
+                        continue
+                    self.entries[row["path"]] = (int(row["size"]), int(row["mtime_ns"]), SignalSummary(
+                        int(row["channels"]), int(row["samples"]), float(row["min_variance"]),
+                        float(row["max_clipped_fraction"]), row["longest_dropout_s"], row["problems"]))
+        except (OSError, KeyError, ValueError):
+            self.entries = dict() # missing or unreadable record, everything is scanned again
+
+    def summaries(self, items):
+        # {eeg path: SignalSummary} for (eeg path, Header) items, scanning only files that changed
+        result = dict()
+        stale = []
+        for path, header in items:
+            st = os.stat(path)
+            key = relpath(abspath(path), abspath(self.dataset))
+            self._seen.add(key)
+            known = self.entries.get(key)
+            if known is not None and known[:2] == (st.st_size, st.st_mtime_ns):
+                result[path] = known[2]
+            else:
+                stale.append((path, header, key, st))
+        if len(stale) > 0:
+            with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+                for (path, _, key, st), summary in zip(stale, pool.map(lambda item: signal_summary(item[0], item[1]), stale)):
+                    self.entries[key] = (st.st_size, st.st_mtime_ns, summary)
+                    result[path] = summary
+            self.scanned += len(stale)
+        return result
+
+    def save(self):
+        # written atomically, entries for files that no longer exist are dropped
+        root = abspath(self.dataset)
+        rows = [[key, size, mtime_ns] + list(summary) + [SIGNAL_VERSION] for key, (size, mtime_ns, summary) in sorted(self.entries.items())
+                if key in self._seen or exists(join(root, key))]
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=dirname(self.path), prefix="." + SIGNAL_RECORD_NAME + ".")
+            with os.fdopen(fd, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(SIGNAL_FIELDS)
+                writer.writerows(rows)
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp_path, 0o666 & ~umask)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
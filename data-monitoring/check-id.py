@@ -1,7 +1,8 @@
+import csv
+import os
 import sys
-import pandas as pd
-import math
-import sys
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 class c:
     RED = '\033[31m'
@@ -10,25 +11,68 @@ class c:
     BOLD = '\033[1m'
     UNDERLINE = '\033[4m'
 
-def check_id(id, file):
-    # extract id col
-    if pd.__version__ >= "1.4.0":
-        file_df = pd.read_csv(file, on_bad_lines="skip")
-    else:
-        file_df = pd.read_csv(file, error_bad_lines=False, warn_bad_lines=False)
-    if "id" in file_df:
-        id_col = file_df["id"]
-    elif "participant" in file_df:
-        id_col = file_df["participant"]
-    else:
-        sys.exit(c.RED + "Error: cannot find id or participant column in"+ file + c.ENDC)
+# problem is "no id column", "missing id" or "mismatch"; found is the first id value as written in the file
+IdMismatch = namedtuple("IdMismatch", ["id", "file", "found", "problem"])
+
+# cells pandas would have read as NaN
+na_values = {"", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+             "<NA>", "N/A", "NA", "NULL", "NaN", "n/a", "nan", "null"}
 
-    # check if first ids match vals listed
-    if isinstance(id_col[0], float) and math.isnan(id_col[0]):
-        print(c.RED + "Error: nan value seen in ID for", file, "file" + c.ENDC)
+def first_id(file):
+    # (column, value) of the first data row's id (or participant) column, reading only the
+    # header and first row; column is None when the file has neither column
+    with open(file, newline="", encoding="utf-8-sig", errors="replace") as f:
+        reader = csv.reader(f)
+        header = next((row for row in reader if len(row) > 0), [])
+        if "id" in header:
+            column = "id"
+        elif "participant" in header:
+            column = "participant"
+        else:
+            return None, None
+        pos = header.index(column)
+        for row in reader:
+            if len(row) == 0 or len(row) > len(header):
+                continue # blank and malformed lines are skipped, as read_csv does
+            return column, row[pos] if pos < len(row) else ""
+    return column, ""
+
+def _check(id, file):
+    column, value = first_id(file)
+    if column is None:
+        return IdMismatch(id, file, None, "no id column")
+    if value.strip() in na_values:
+        return IdMismatch(id, file, value, "missing id")
+    try:
+        matches = int(float(value)) == int(id)
+    except ValueError:
+        matches = False
+    if not matches:
+        return IdMismatch(id, file, value, "mismatch")
+    return None
+
+def check_ids(pairs, jobs=None):
+    # IdMismatch for every (id, file) pair whose file does not start with that id, in input order
+    pairs = list(pairs)
+    if len(pairs) <= 1:
+        results = [_check(id, file) for id, file in pairs]
     else:
-        if not int(id_col[0]) == int(id):
-            print(c.RED + "Error: ID value in", file, str(id_col[0]), "does not match", id + c.ENDC)
+        with ThreadPoolExecutor(max_workers=jobs or min(8, os.cpu_count() or 1)) as pool:
+            results = list(pool.map(lambda pair: _check(*pair), pairs))
+    return [result for result in results if result is not None]
+
+def message(mismatch):
+    if mismatch.problem == "no id column":
+        return c.RED + "Error: cannot find id or participant column in" + mismatch.file + c.ENDC
+    if mismatch.problem == "missing id":
+        return c.RED + "Error: nan value seen in ID for " + mismatch.file + " file" + c.ENDC
+    return c.RED + "Error: ID value in " + mismatch.file + " " + mismatch.found + " does not match " + str(mismatch.id) + c.ENDC
+
+def check_id(id, file):
+    for mismatch in check_ids([(id, file)]):
+        if mismatch.problem == "no id column":
+            sys.exit(message(mismatch))
+        print(message(mismatch))
 
 if __name__ == "__main__":
     id = sys.argv[1]
@@ -1,9 +1,15 @@
+import numpy as np
 import pandas as pd
 import sys
-from os.path import basename, normpath, join, isdir, isfile, splitext
-from os import listdir, walk
+from collections import defaultdict
+from os.path import basename, normpath, isfile, splitext
+from os import walk
 import pathlib
-import re
+
+import datadict_plan
+import file_inventory
+import redcap_loader
+import tracker_model
 
 if __name__ == "__main__":
     dataset = sys.argv[1]
@@ -18,45 +24,29 @@ if __name__ == "__main__":
     raw = "{}/sourcedata/raw".format(dataset)
     checked = "{}/sourcedata/checked".format(dataset)
 
-    df_dd = pd.read_csv(datadict, index_col = "variable")
-    tracker_df = pd.read_csv(tracker, index_col = "id")
-
+    plan = datadict_plan.load_plan(datadict)
+    tracker_df = tracker_model.read_tracker(tracker)
+    # subjects with a no-data.txt, per datatype folder, from one scan of checked
+    no_data_subs = defaultdict(set)
+    for (sub, _, datatype), folder in file_inventory.scan_checked(checked, session).items():
+        if folder.no_data:
+            no_data_subs[datatype].add(sub)
+    missing_groups = defaultdict(list) # missing tasks -> subjects, reported together at the end
+
+    if len(plan.visit_errors) > 0:
+        sys.exit(plan.visit_errors[0])
     visit_dict = {}
-    for var, row in df_dd.iterrows():
-        if row['dataType'] == "visit_status":
-            try:
-                visit = re.match('(.+)_status', var).group(1)
-            except:
-                sys.exit("Unexpected row name for visit status " + var + ", exiting.")
-            prov = row["provenance"].split(" ")
-            if "file:" in prov and "variable:" in prov:
-                idx = prov.index("file:")
-                rc_filename = prov[idx+1].strip("\";,")
-                idx = prov.index("variable:")
-                rc_variable = prov[idx+1].strip("\";,")
-            if "id:" in prov:
-                idx = prov.index("id:")
-                rc_idcol = prov[idx+1].strip("\";,")
-                rc_idcol = rc_idcol + '_' + session + '_e1'
-            else:
-                rc_idcol = "record_id"
-            datarow = df_dd.loc[visit + '_data',:]
-            tasks = []
-            dprov = datarow['provenance'].split(':')
-            if "variables" in dprov:
-                idx = dprov.index("variables")
-                for task in dprov[idx+1].split(','):
-                    task = task.strip("\";, ")
-                    tasks.append(task)
-            visit_dict[visit] = [rc_filename, rc_variable, rc_idcol, tasks]
+    for visit, spec in plan.visits.items():
+        rc_idcol = spec.id_column + '_' + session + '_e1' if spec.id_column is not None else "record_id"
+        visit_dict[visit] = [spec.redcap, spec.variable, rc_idcol, spec.tasks]
     task_datatype = {}
     for visit, vals in visit_dict.items():
         task_datatype = {}
         for task in vals[3]:
-            if task not in list(df_dd.index):
+            if task not in plan.datatypes:
                 sys.exit("Task " + task + " not found in datadict, exiting.")
             else:
-                task_datatype[task] = df_dd.loc[task, 'dataType']
+                task_datatype[task] = plan.datatypes[task]
         found_rc = False
         for i in range(0, len(redcap_list)):
             if vals[0] in redcap_list[i]:
@@ -65,51 +55,37 @@ if __name__ == "__main__":
                 break
         if not found_rc:
             sys.exit("Can't find redcap with name " + vals[0] +", exiting.")
-        rc_df = pd.read_csv(redcap, index_col = vals[2])
         rc_var = vals[1]
+        rc_df = redcap_loader.read_redcap(redcap, [vals[2], rc_var+"_"+session+"_e1_complete"]).set_index(vals[2])
         subs_w_data = list(rc_df[rc_df[rc_var+"_"+session+"_e1_complete"] == 2].index) #? always be a _complete column?
-        tracker_df.loc[subs_w_data, visit+'_status_'+session+'_e1'] = 1
-        for sub in subs_w_data:
-            no_data_tasks = []
-            for task, dtype in task_datatype.items():
-                if dtype == 'combination':
-                    comb_vars = df_dd.loc['arrow-alert_psychopy','provenance'].split(":")[1].split(",")
-                    comb_vars = [x.strip("\" ") for x in comb_vars]
-                    #comb_vars = [x.strip("\" ") for x in df_dd.loc['arrow-alert_psychopy','provenance'].split(":")[1].split(",")
-                    folders = []
-                    for var in comb_vars:
-                        folders.append(df_dd.loc[var,'dataType'])
-                    for folder in folders:
-                        if isdir(join(checked, 'sub-'+str(int(sub)), session, folder)):
-                            for dfile in listdir(join(checked, 'sub-'+str(int(sub)), session, folder)):
-                                if dfile == "no-data.txt":
-                                    if task not in no_data_tasks:
-                                        no_data_tasks.append(task)
-                    continue
-                if isdir(join(checked, 'sub-'+str(int(sub)), session, dtype)):
-                    for dfile in listdir(join(checked, 'sub-'+str(int(sub)), session, dtype)):
-                        if dfile == "no-data.txt":
-                            no_data_tasks.append(task)
-                            break
-            allpresent = True
-            checked = join(dataset, 'sourcedata', 'checked') #?
-            missing_tasks = []
-            ignore_no_data = False
-            for task in vals[3]:
-                if not tracker_df.loc[sub, task + '_' + session + '_e1'] == 1 and task not in no_data_tasks:
-                    allpresent = False
-                    missing_tasks.append(task)
-                elif task in no_data_tasks:
-                    ignore_no_data = True
-                    tracker_df.loc[sub, visit+'_data_'+session+'_e1'] = 0
-            if allpresent and ignore_no_data:
-                continue # no error
-            if allpresent:
-                tracker_df.loc[sub, visit+'_data_'+session+'_e1'] = 1
+        tracker_model.set_cells(tracker_df, visit+'_status_'+session+'_e1', subs_w_data, 1)
+        subs = pd.Index(subs_w_data).unique()
+        if len(subs) == 0:
+            continue
+        tasks = vals[3]
+        # subject x task matrices: marked present in the tracker, no-data.txt in (one of) the task's datatype folders
+        present = tracker_model.flags(tracker_df.loc[subs, [task + '_' + session + '_e1' for task in tasks]]).to_numpy(dtype=bool)
+        sub_ids = np.array([int(sub) for sub in subs])
+        no_data = np.zeros((len(subs), len(tasks)), dtype=bool)
+        for i, task in enumerate(tasks):
+            if task_datatype[task] == 'combination':
+                folders = [plan.datatypes[var] for var in plan.combinations[task].variables]
             else:
-                tracker_df.loc[sub, visit+'_data_'+session+'_e1'] = 0
-                print("\033[31mError: Expected tasks " + ", ".join(missing_tasks) + " not seen in subject " + str(sub) + ", session " + session + ".\033[0m")
-    tracker_df.to_csv(tracker)
+                folders = [task_datatype[task]]
+            no_data[:, i] = np.isin(sub_ids, list(set().union(*[no_data_subs[folder] for folder in folders])))
+        missing = ~present & ~no_data
+        # all expected tasks there and none of them excused by a no-data.txt
+        has_data = ~missing.any(axis=1) & ~no_data.any(axis=1)
+        tracker_model.set_cells(tracker_df, visit+'_data_'+session+'_e1', list(subs), has_data.astype("int8"))
+        for sub, row in zip(subs, missing):
+            if row.any():
+                missing_groups[", ".join(task for task, absent in zip(tasks, row) if absent)].append(str(sub))
+    if len(missing_groups) > 0:
+        print("\033[31mError: Expected tasks not seen in session " + session + ":")
+        for missing_tasks, subs in missing_groups.items():
+            print("  " + missing_tasks + ": " + ", ".join(subs))
+        print("\033[0m", end="")
+    tracker_model.write_tracker(tracker_df, tracker)
 
 
 
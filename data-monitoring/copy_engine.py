@@ -0,0 +1,123 @@
+import errno
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from os.path import basename, dirname, join
+
+try:
+    import fcntl
+except ImportError: # not on Linux/macOS, reflinks are never tried
+    fcntl = None
+
+# Copies files from sourcedata/raw to sourcedata/checked inside the Python process instead
+# of one "mkdir -p"/"cp -p" shell per file: copies run on a small thread pool, each
+# destination folder is created once, the data is cloned (reflink) or copied in the kernel
+# (copy_file_range) when the filesystem allows it, and the run ends with one summary.
+
+FICLONE = 0x40049409 # linux/fs.h, share the source extents on btrfs/xfs instead of copying
+_chunk = 64 * 1024 * 1024
+_fallback_errnos = {errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL, errno.ENOTTY, errno.EBADF, errno.EPERM}
+
+def _clone(src_f, dst_f):
+    if fcntl is None:
+        return False
+    try:
+        fcntl.ioctl(dst_f.fileno(), FICLONE, src_f.fileno())
+        return True
+    except OSError:
+        return False
+
+def _copy_range(src_f, dst_f, size):
+    if not hasattr(os, "copy_file_range"):
+        return False
+    copied = 0
+    try:
+        while copied < size:
+            sent = os.copy_file_range(src_f.fileno(), dst_f.fileno(), min(_chunk, size - copied))
+            if sent == 0:
+                break
+            copied += sent
+    except OSError as e:
+        if e.errno in _fallback_errnos and copied == 0:
+            return False
+        raise
+    if copied != size:
+        raise OSError("source changed during copy: " + str(copied) + " of " + str(size) + " bytes")
+    return True
+
+def copy_data(src, dst):
+    # contents of src into a new file dst: reflink, then copy_file_range, then a plain copy
+    size = os.stat(src).st_size
+    with open(src, "rb") as src_f, open(dst, "wb") as dst_f:
+        if size == 0 or _clone(src_f, dst_f) or _copy_range(src_f, dst_f, size):
+            return size
+        src_f.seek(0)
+        dst_f.seek(0)
+        dst_f.truncate()
+        shutil.copyfileobj(src_f, dst_f, _chunk)
+        if dst_f.tell() != size:
+            raise OSError("source changed during copy: " + str(dst_f.tell()) + " of " + str(size) + " bytes")
+    return size
+
+class CopyEngine:
+    def __init__(self, jobs=None):
+        self.jobs = jobs or min(8, os.cpu_count() or 1)
+        self.files = 0
+        self.bytes = 0
+        self.errors = [] # (src, dst, message)
+        self._made_dirs = set()
+        self._pool = ThreadPoolExecutor(max_workers=self.jobs)
+        self._pending = []
+        self._queued = set()
+
+    def makedirs(self, path):
+        if path not in self._made_dirs:
+            os.makedirs(path, exist_ok=True)
+            self._made_dirs.add(path)
+
+    def copy(self, src, dst, preserve=True):
+        # queue src -> dst; preserve keeps timestamps like "cp -p", otherwise only the mode is
+        # copied like "cp". dst is written under a temporary name and renamed when complete
+        if dst in self._queued:
+            return
+        self._queued.add(dst)
+        self.makedirs(dirname(dst))
+        self._pending.append(self._pool.submit(self._copy, src, dst, preserve))
+
+    def _copy(self, src, dst, preserve):
+        tmp_dst = join(dirname(dst), "." + basename(dst) + ".copying")
+        try:
+            size = copy_data(src, tmp_dst)
+            if preserve:
+                shutil.copystat(src, tmp_dst)
+                st = os.stat(src)
+                try:
+                    os.chown(tmp_dst, st.st_uid, st.st_gid)
+                except OSError:
+                    pass # like cp -p, ownership is kept only when allowed
+            else:
+                shutil.copymode(src, tmp_dst)
+            os.replace(tmp_dst, dst)
+            return size, None
+        except OSError as e:
+            if os.path.exists(tmp_dst):
+                os.remove(tmp_dst)
+            return 0, (src, dst, str(e))
+
+    def wait(self):
+        # block until every queued copy finished, then add them to the totals
+        for future in self._pending:
+            size, error = future.result()
+            if error is None:
+                self.files += 1
+                self.bytes += size
+            else:
+                self.errors.append(error)
+        self._pending = []
+
+    def close(self):
+        self.wait()
+        self._pool.shutdown()
+
+    def summary(self):
+        return "Copied " + str(self.files) + " files (" + "{:.1f}".format(self.bytes / 1024 / 1024) + " MB) to checked, " + str(len(self.errors)) + " failed"
@@ -0,0 +1,232 @@
+import bisect
+import hashlib
+import io
+import math
+import os
+import pickle
+import re
+import tempfile
+from collections import defaultdict, namedtuple
+from glob import glob
+from os.path import abspath, basename, dirname, join
+
+import numpy as np
+import pandas as pd
+
+# Compiles central-tracker_datadict.csv once into the lookup tables used by the
+# data-monitoring scripts and caches the result next to the tracker, keyed by a hash
+# of the datadict contents, so every script in a hallMonitor run can share it.
+
+# bump whenever the layout of DatadictPlan changes so stale caches are recompiled
+PLAN_VERSION = 2
+
+completed = "_complete"
+
+TaskSpec = namedtuple("TaskSpec", ["datatype", "exts", "suffixes"])
+CombinationSpec = namedtuple("CombinationSpec", ["variables", "suffixes"])
+VisitSpec = namedtuple("VisitSpec", ["redcap", "variable", "id_column", "tasks"])
+ParentSpec = namedtuple("ParentSpec", ["variable", "datatype", "redcap", "rc_variable", "suffixes"])
+RedcapSpec = namedtuple("RedcapSpec", ["variable", "datatype", "suffixes", "redcap", "rc_variable", "id_column"])
+
+def _is_nan(value):
+    return isinstance(value, float) and math.isnan(value)
+
+def _provenance_value(prov, tag, strip_chars):
+    # value following e.g. 'file:' in a space-split provenance string
+    if tag not in prov:
+        return None
+    return prov[prov.index(tag) + 1].strip(strip_chars)
+
+class IdIntervals:
+    # allowed participant IDs as sorted, merged [lower, upper] bounds: one bisect per ID,
+    # or one searchsorted for a whole array of IDs
+    def __init__(self, intervals):
+        merged = []
+        for lower, upper in sorted(intervals):
+            if len(merged) > 0 and lower <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], upper)
+            else:
+                merged.append([lower, upper])
+        self.lowers = np.array([lower for lower, _ in merged], dtype="float64")
+        self.uppers = np.array([upper for _, upper in merged], dtype="float64")
+        self._lowers = self.lowers.tolist()
+        self._uppers = self.uppers.tolist()
+
+    def allowed(self, value):
+        value = int(value)
+        pos = bisect.bisect_right(self._lowers, value) - 1
+        return pos >= 0 and value <= self._uppers[pos]
+
+    def allowed_many(self, values):
+        # boolean array, True for every ID inside one of the intervals
+        values = np.asarray(values, dtype="float64")
+        if len(self.lowers) == 0:
+            return np.zeros(values.shape, dtype=bool)
+        pos = np.searchsorted(self.lowers, values, side="right") - 1
+        return (pos >= 0) & (values <= self.uppers[np.maximum(pos, 0)])
+
+class DatadictPlan:
+    def __init__(self, digest):
+        self.digest = digest
+        self.datatypes = dict() # variable -> dataType, for every datadict row
+        self.tasks = dict() # variable -> TaskSpec, for rows with an expectedFileExt
+        self.invalid_tasks = [] # rows with an expectedFileExt but no dataType
+        self.combinations = dict() # variable -> CombinationSpec
+        self.visits = dict() # visit name -> VisitSpec
+        self.visit_errors = []
+        self.parents = [] # ParentSpec for parent_identity and parent_lang rows
+        self.redcap_specs = [] # RedcapSpec for consent, assent and redcap_data rows
+        self.id_source = None # (redcap, variable) the participant IDs are read from
+        self.id_allowed_values = None # raw allowedValues string for the id row
+        self.id_intervals = [] # [(lower, upper), ...] parsed from id_allowed_values
+        self.allowed_ids = IdIntervals([]) # id_intervals compiled for lookups
+        self.study_no = None
+        self._redcap_columns = dict()
+
+    def redcap_columns(self, session):
+        # {redcap: {"<rc column>_complete": tracker column, ["id_column": id col]}} and the
+        # list of keys that are allowed to be duplicated across redcaps, for one session
+        if session not in self._redcap_columns:
+            self._redcap_columns[session] = compile_redcap_columns(self.redcap_specs, session)
+        return self._redcap_columns[session]
+
+    def task_datatypes(self, datatype):
+        return [var for var, dtype in self.datatypes.items() if dtype == datatype]
+
+def compile_redcap_columns(redcap_specs, session):
+    cols = {}
+    key_counter = defaultdict(lambda: 0)
+    allowed_duplicate_columns = []
+    for spec in redcap_specs:
+        if spec.suffixes is None:
+            allowed_suffixes = [""]
+        else:
+            allowed_suffixes = ["_" + ses for ses in spec.suffixes if ses.startswith(session)] # only from same session
+        if spec.redcap not in cols.keys():
+            cols[spec.redcap] = {}
+        if spec.id_column is not None:
+            cols[spec.redcap]["id_column"] = spec.id_column
+        for ses_tag in allowed_suffixes:
+            var = spec.variable
+            cols[spec.redcap][spec.rc_variable + ses_tag + completed] = var + ses_tag
+            key_counter[spec.rc_variable + ses_tag + completed] += 1
+            # also map Sp. surveys to same column name in central tracker if completed
+            surv_match = re.match(r'^([a-zA-Z0-9\-]+)(_[a-z0-9]{1,2})?(_scrd[a-zA-Z]+)?(_[a-zA-Z]{2,})?$', spec.rc_variable)
+            if surv_match and "redcap_data" in spec.datatype:
+                surv_version = '' if not surv_match.group(2) else surv_match.group(2)
+                scrd_str = '' if not surv_match.group(3) else surv_match.group(3)
+                multiple_report_tag = '' if not surv_match.group(4) else surv_match.group(4)
+                surv_esp = surv_match.group(1) + 'es' + surv_version + scrd_str + multiple_report_tag + ses_tag
+                cols[spec.redcap][surv_esp + completed] = var + ses_tag
+                key_counter[surv_esp + completed] += 1
+            if "consent" in spec.datatype:
+                cols[spec.redcap][spec.rc_variable + "es" + completed] = var
+    for key, value in key_counter.items():
+        if value > 1:
+            allowed_duplicate_columns.append(key)
+    return cols, allowed_duplicate_columns
+
+def compile_plan(datadict_df, digest=None):
+    plan = DatadictPlan(digest)
+    df = datadict_df.set_index("variable", drop=False)
+    sessions = set([""])
+    for var, row in df.iterrows():
+        datatype = row["dataType"]
+        suffixes = None if _is_nan(row["allowedSuffix"]) else row["allowedSuffix"].split(", ")
+        plan.datatypes[var] = None if _is_nan(datatype) else datatype
+        for suf in suffixes or []:
+            ses_re = re.match("(s[0-9]+_r[0-9]+)(_e[0-9]+)?", suf)
+            if ses_re:
+                sessions.add(ses_re.group(1))
+        if not _is_nan(row["expectedFileExt"]):
+            if isinstance(datatype, str) and isinstance(row["expectedFileExt"], str):
+                plan.tasks[var] = TaskSpec(datatype, row["expectedFileExt"].split(", "), suffixes or [])
+            else:
+                plan.invalid_tasks.append(var)
+        if not isinstance(datatype, str):
+            continue
+        prov_str = row["provenance"] if isinstance(row["provenance"], str) else ""
+        prov = prov_str.split(" ")
+        if datatype in ["consent", "assent", "redcap_data"] and "file:" in prov and "variable:" in prov:
+            rc_variable = _provenance_value(prov, "variable:", "\";,")
+            if rc_variable == "":
+                rc_variable = var.lower()
+            plan.redcap_specs.append(RedcapSpec(var, datatype, suffixes, _provenance_value(prov, "file:", "\";,"),
+                                                rc_variable, _provenance_value(prov, "id:", "\";,")))
+        elif datatype == "combination":
+            idx = prov.index("variables:")
+            comb_vars = "".join(prov[idx+1:]).split(",")
+            plan.combinations[var] = CombinationSpec([v.strip("\"") for v in comb_vars], suffixes or [])
+        elif datatype in ["parent_identity", "parent_lang"] and "file:" in prov and "variable:" in prov:
+            plan.parents.append(ParentSpec(var, datatype, _provenance_value(prov, "file:", "\";"),
+                                           _provenance_value(prov, "variable:", "\";"), suffixes or []))
+        elif datatype == "visit_status":
+            visit_re = re.match('(.+)_status', var)
+            if not visit_re:
+                plan.visit_errors.append("Unexpected row name for visit status " + var + ", exiting.")
+                continue
+            visit = visit_re.group(1)
+            tasks = []
+            if visit + "_data" in df.index and isinstance(df.loc[visit + "_data", "provenance"], str):
+                dprov = df.loc[visit + "_data", "provenance"].split(':')
+                if "variables" in dprov:
+                    idx = dprov.index("variables")
+                    tasks = [task.strip("\";, ") for task in dprov[idx+1].split(',')]
+            plan.visits[visit] = VisitSpec(_provenance_value(prov, "file:", "\";,"), _provenance_value(prov, "variable:", "\";,"),
+                                           _provenance_value(prov, "id:", "\";,"), tasks)
+
+    if "id" in df.index:
+        # ID provenance should contain redcap and variable from which to read IDs, in format 'file: "{name of redcap}"; variable: "{column name}"'
+        id_desc = df.loc["id", "provenance"].split(" ")
+        id_rc = id_var = None
+        for i, token in enumerate(id_desc[:-1]):
+            if "file:" in token:
+                id_rc = id_desc[i+1].strip("\"\';,()")
+            elif "variable:" in token:
+                id_var = id_desc[i+1].strip("\"\';,()")
+        if id_rc is not None and id_var is not None:
+            plan.id_source = (id_rc, id_var)
+        allowed_vals = df.loc["id", "allowedValues"]
+        if isinstance(allowed_vals, str):
+            plan.id_allowed_values = allowed_vals
+            intervals = re.split(r"[\[\]]", allowed_vals.replace(" ", ""))
+            intervals = list(filter(lambda x: x not in [",", ""], intervals))
+            plan.study_no = intervals[0][0:2] # first two digits should be study no.
+            plan.id_intervals = [(float(i.split(",")[0]), float(i.split(",")[1])) for i in intervals]
+            plan.allowed_ids = IdIntervals(plan.id_intervals)
+
+    for session in sessions:
+        plan.redcap_columns(session)
+    return plan
+
+def default_cache_dir(datadict_path):
+    # <dataset>/data-monitoring/.cache, alongside the central tracker
+    return join(dirname(dirname(abspath(datadict_path))), ".cache")
+
+def load_plan(datadict_path, cache_dir=None):
+    with open(datadict_path, "rb") as f:
+        contents = f.read()
+    digest = hashlib.sha256(contents + str(PLAN_VERSION).encode()).hexdigest()
+    if cache_dir is None:
+        cache_dir = default_cache_dir(datadict_path)
+    cache_file = join(cache_dir, "datadict-plan_" + digest[:16] + ".pkl")
+    try:
+        with open(cache_file, "rb") as f:
+            plan = pickle.load(f)
+        if isinstance(plan, DatadictPlan) and plan.digest == digest:
+            return plan
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        pass
+    plan = compile_plan(pd.read_csv(io.BytesIO(contents)), digest)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=".datadict-plan_")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(plan, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_file)
+        for old in glob(join(cache_dir, "datadict-plan_*.pkl")):
+            if basename(old) != basename(cache_file):
+                os.remove(old)
+    except OSError:
+        pass # a read-only dataset still works, the plan is just recompiled next time
+    return plan
@@ -0,0 +1,94 @@
+import csv
+import hashlib
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from os.path import abspath, dirname, exists, join, relpath
+
+# Persistent (path, size, mtime, hash) record of the raw and checked files verify-copy.py
+# compares. A file whose size and mtime match its record is not read again; any other file
+# is hashed on a thread pool. Hashes are xxh3-128 when xxhash is installed, blake2b from
+# the standard library otherwise; records made with the other algorithm are rehashed.
+
+try:
+    import xxhash
+    algorithm = "xxh3_128"
+    def _new_hash():
+        return xxhash.xxh3_128()
+except ImportError:
+    algorithm = "blake2b"
+    def _new_hash():
+        return hashlib.blake2b(digest_size=16)
+
+RECORD_NAME = "file-checksum-record.csv"
+FIELDS = ["path", "size", "mtime_ns", "hash"]
+_chunk = 8 * 1024 * 1024
+
+def record_path(dataset):
+    # next to the other per-dataset records in data-monitoring/
+    return join(dataset, "data-monitoring", RECORD_NAME)
+
+def file_hash(path):
+    digest = _new_hash()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_chunk), b""):
+            digest.update(block)
+    return algorithm + ":" + digest.hexdigest()
+
+class ChecksumRecord:
+    def __init__(self, dataset, jobs=None):
+        self.dataset = dataset
+        self.path = record_path(dataset)
+        self.jobs = jobs or min(8, os.cpu_count() or 1)
+        self.entries = dict() # path relative to dataset -> (size, mtime_ns, hash)
+        self.hashed = 0 # files read this run
+        self._seen = set()
+        try:
+            with open(self.path, newline="") as f:
+                for row in csv.DictReader(f):
+                    if row["hash"].startswith(algorithm + ":"):
+                        self.entries[row["path"]] = (int(row["size"]), int(row["mtime_ns"]), row["hash"])
+        except (OSError, KeyError, ValueError):
+            self.entries = dict() # missing or unreadable record, everything is hashed again
+
+    def hashes(self, paths):
+        # {path: hash} for every existing file in paths, reading only files that changed since they were recorded
+        result = dict()
+        stale = []
+        for path in dict.fromkeys(paths):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            key = relpath(abspath(path), abspath(self.dataset))
+            self._seen.add(key)
+            known = self.entries.get(key)
+            if known is not None and known[:2] == (st.st_size, st.st_mtime_ns):
+                result[path] = known[2]
+            else:
+                stale.append((path, key, st))
+        if len(stale) > 0:
+            with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+                for (path, key, st), digest in zip(stale, pool.map(lambda item: file_hash(item[0]), stale)):
+                    self.entries[key] = (st.st_size, st.st_mtime_ns, digest)
+                    result[path] = digest
+            self.hashed += len(stale)
+        return result
+
+    def save(self):
+        # entries for files that no longer exist are dropped; written atomically, a failure only costs rehashing
+        root = abspath(self.dataset)
+        rows = [[key] + list(entry) for key, entry in sorted(self.entries.items())
+                if key in self._seen or exists(join(root, key))]
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=dirname(self.path), prefix="." + RECORD_NAME + ".")
+            with os.fdopen(fd, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(FIELDS)
+                writer.writerows(rows)
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp_path, 0o666 & ~umask)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
@@ -0,0 +1,182 @@
+import os
+import re
+from collections import namedtuple
+
+# One pass over sourcedata/checked with os.scandir. Every filename is parsed once into
+# its (sub, task, suffix, extra, ext) fields and deviation/no-data markers are recorded
+# per folder, so presence checks become dictionary lookups instead of a listdir() and a
+# freshly built regex for every candidate file.
+
+FileName = namedtuple("FileName", ["sub", "task", "suffix", "extra", "ext"])
+
+# sub-<#>_<task>_<sX_rX_eX>[<extra>]<.ext[.ext]>, where extra is only allowed next to a deviation file
+filename_re = re.compile(r'^sub-([0-9]+)_([a-zA-Z0-9_-]+)_(s[0-9]+_r[0-9]+_e[0-9]+)([a-zA-Z0-9_-]*)((?:\.[a-zA-Z0-9]+)+)$')
+deviation_re = re.compile('^[Dd]eviation.*$')
+no_data_name = "no-data.txt"
+session_re = re.compile('^s[0-9]+_r[0-9]+$')
+subject_re = re.compile('^sub-([0-9]+)$')
+
+# verify-copy.py's naming convention check: looser than filename_re so that every missing
+# piece (subject #, session #, extension, ...) can be reported on its own
+Convention = namedtuple("Convention", ["sub_label", "sub", "task", "suffix", "session", "ses_no", "run_no", "event_no", "extra", "ext"])
+convention_re = re.compile(r'^(sub-([0-9]*))_([a-zA-Z0-9_-]*)_((s([0-9]*)_r([0-9]*))_e([0-9]*))(_[a-zA-Z0-9_-]+)?((?:\.[a-zA-Z]+)*)$')
+
+def parse_convention(filename):
+    file_re = convention_re.match(filename)
+    if not file_re:
+        return None
+    return Convention(*file_re.groups())
+
+def parse_filename(filename):
+    file_re = filename_re.match(filename)
+    if not file_re:
+        return None
+    return FileName(int(file_re.group(1)), file_re.group(2), file_re.group(3), file_re.group(4), file_re.group(5))
+
+class DirInventory:
+    def __init__(self, path, signature=None):
+        self.path = path
+        self.signature = signature # (mtime_ns, size) of the folder itself
+        self.scanned = False
+        self.names = []
+        self.files = [] # FileName for every name that follows the naming convention
+        self.parsed = dict() # name -> FileName, for the same names
+        self.deviation = False
+        self.no_data = False
+        self._exact = set()
+        self._relaxed = set()
+
+    def add(self, name):
+        self.names.append(name)
+        if name == no_data_name:
+            self.no_data = True
+        elif deviation_re.match(name):
+            self.deviation = True
+        parsed = parse_filename(name)
+        if parsed is not None:
+            self.files.append(parsed)
+            self.parsed[name] = parsed
+            key = (parsed.sub, parsed.task, parsed.suffix, parsed.ext)
+            self._relaxed.add(key)
+            if parsed.extra == "":
+                self._exact.add(key)
+
+    def has_file(self, sub, task, suffix, ext):
+        # when a deviation file is present allow any string between suffix and ext (e.g. "s1_r1_e1_firstrun_practice.eeg")
+        found = self._relaxed if self.deviation else self._exact
+        return (sub, task, suffix, ext) in found
+
+def dir_signature(entry):
+    # adding, removing or renaming a file updates the folder mtime, which is all presence depends on
+    st = entry.stat()
+    return (st.st_mtime_ns, st.st_size)
+
+def _subdirs(path):
+    try:
+        with os.scandir(path) as it:
+            return sorted((entry.name, entry) for entry in it if entry.is_dir())
+    except OSError:
+        return []
+
+def _scan_dir(entry, known):
+    folder = DirInventory(entry.path, dir_signature(entry))
+    if known is not None and folder.signature == known[0]:
+        for name in known[1]: # unchanged since the last scan, reuse its listing
+            folder.add(name)
+        return folder
+    with os.scandir(entry.path) as it:
+        for file_entry in sorted(it, key=lambda e: e.name):
+            if not file_entry.is_dir():
+                folder.add(file_entry.name)
+    folder.scanned = True
+    return folder
+
+def scan_checked(checked_path, session=None, known=None):
+    # {(sub, session, datatype): DirInventory} for checked/sub-#/[session/]datatype folders;
+    # session is "" for datasets without session folders. Pass session to only walk that
+    # session, and known={key: (signature, names)} from a previous scan to reuse the
+    # listing of folders that haven't changed since
+    known = known or dict()
+    inventory = dict()
+    for sub_name, sub_entry in _subdirs(checked_path):
+        sub_re = subject_re.match(sub_name)
+        if not sub_re:
+            continue
+        sub = int(sub_re.group(1))
+        for name, entry in _subdirs(sub_entry.path):
+            if session_re.match(name):
+                if session is not None and name != session:
+                    continue
+                for datatype, dtype_entry in _subdirs(entry.path):
+                    key = (sub, name, datatype)
+                    inventory[key] = _scan_dir(dtype_entry, known.get(key))
+            elif session is None or session == "":
+                key = (sub, "", name)
+                inventory[key] = _scan_dir(entry, known.get(key))
+    return inventory
+
+class TreeSnapshot:
+    # listing of whole directory trees taken once with scandir: listdir/isdir/isfile/getsize
+    # answer from memory with the same results (and errors) as the os functions would have
+    # given at scan time, names sorted. Paths are compared after normpath
+    def __init__(self):
+        self._dirs = dict() # dir path -> sorted names
+        self._sizes = dict() # path of every entry -> size
+        self._inventories = dict()
+
+    def scan(self, root):
+        visited = set()
+        pending = [os.path.normpath(root)]
+        while pending:
+            path = pending.pop()
+            try:
+                real = os.path.realpath(path)
+                if real in visited: # symlink loop
+                    continue
+                visited.add(real)
+                with os.scandir(path) as it:
+                    entries = sorted(it, key=lambda e: e.name)
+            except OSError:
+                continue
+            self._dirs[path] = [entry.name for entry in entries]
+            for entry in entries:
+                entry_path = os.path.join(path, entry.name)
+                try:
+                    self._sizes[entry_path] = entry.stat().st_size
+                    if entry.is_dir():
+                        pending.append(entry_path)
+                except OSError:
+                    continue
+
+    def isdir(self, path):
+        return os.path.normpath(path) in self._dirs
+
+    def isfile(self, path):
+        path = os.path.normpath(path)
+        return path in self._sizes and path not in self._dirs
+
+    def listdir(self, path):
+        path = os.path.normpath(path)
+        if path not in self._dirs:
+            if path in self._sizes:
+                raise NotADirectoryError(20, "Not a directory", path)
+            raise FileNotFoundError(2, "No such file or directory", path)
+        return list(self._dirs[path])
+
+    def getsize(self, path):
+        path = os.path.normpath(path)
+        if path not in self._sizes:
+            raise FileNotFoundError(2, "No such file or directory", path)
+        return self._sizes[path]
+
+    def inventory(self, path):
+        # DirInventory of the files directly in path, built once
+        path = os.path.normpath(path)
+        if path not in self._inventories:
+            folder = DirInventory(path)
+            for name in self.listdir(path):
+                if not self.isdir(os.path.join(path, name)):
+                    folder.add(name)
+            folder.scanned = True
+            self._inventories[path] = folder
+        return self._inventories[path]
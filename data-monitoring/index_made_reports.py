@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+import sys
+import csv
+import hashlib
+import io
+import json
+import os
+import re
+import sqlite3
+from datetime import datetime
+from os.path import join
+
+import made_reports
+
+# Folds every row of every MADE_preprocessing_report_*.csv into one SQLite table,
+# data-monitoring/.cache/made-report-index.sqlite, for cross-subject QA queries such as
+#   select session, avg(total_epochs_after_artifact_rejection) from reports group by session
+# MADE_pipeline.m only appends to a report, so a report that grew since the last run and
+# still starts with the bytes indexed then is read from where the previous run stopped; a
+# report that shrank or was rewritten is read again from the start, and rows of deleted
+# reports are dropped.
+#
+# usage: index_made_reports.py <dataset> [session ...]
+
+INDEX_NAME = "made-report-index.sqlite"
+
+# typed report fields written by MADE_pipeline.m, any other column is kept as TEXT
+FIELD_TYPES = {"datafile_names": "TEXT", "date_processed": "TEXT", "reference_used_for_faster": "TEXT",
+               "faster_bad_channels": "TEXT", "ica_preparation_bad_channels": "TEXT", "length_ica_data": "REAL",
+               "total_ICs": "INTEGER", "ICs_removed": "TEXT", "total_epochs_before_artifact_rejection": "INTEGER",
+               "total_epochs_after_artifact_rejection": "INTEGER", "total_channels_interpolated": "INTEGER",
+               "any_usable_data": "INTEGER"}
+KEY_COLUMNS = ["subject", "task", "session", "suffix", "description", "error", "run_timestamp", "file", "line"]
+
+session_re = re.compile('^s[0-9]+_r[0-9]+$')
+
+def index_path(dataset_path):
+    return join(dataset_path, "data-monitoring", ".cache", INDEX_NAME)
+
+def connect(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    db = sqlite3.connect(path)
+    db.execute("create table if not exists report_files (file text primary key, mtime_ns integer, size integer, columns text, "
+               "digest text)")
+    fields = ", ".join(col + " " + kind for col, kind in FIELD_TYPES.items())
+    db.execute("create table if not exists reports (subject integer, task text, session text, suffix text, description text, "
+               "error integer, run_timestamp text, file text, line integer, " + fields + ")")
+    db.execute("create index if not exists reports_subject_session on reports (subject, session)")
+    db.execute("create index if not exists reports_file on reports (file)")
+    return db
+
+def _columns(db):
+    return [row[1] for row in db.execute("pragma table_info(reports)")]
+
+def _timestamp(value):
+    # MATLAB's datetime('now') as ISO 8601, so runs sort and compare as text
+    if not isinstance(value, str):
+        return None
+    try:
+        return datetime.strptime(value, "%d-%b-%Y %H:%M:%S").isoformat(sep=" ")
+    except ValueError:
+        return value
+
+def _typed(value, kind):
+    value = made_reports.parse_value(value)
+    if value is None or kind == "TEXT":
+        return value if value is None else str(value)
+    if kind == "INTEGER" and isinstance(value, float) and value % 1 == 0:
+        return int(value)
+    return value
+
+def report_files(out_location, sessions):
+    # (path, subject, session, Match) for every MADE report under derivatives/preprocessed
+    found = []
+    for sub_folder in sorted(os.listdir(out_location)):
+        if not sub_folder.startswith("sub-") or not os.path.isdir(join(out_location, sub_folder)):
+            continue
+        for session in sorted(os.listdir(join(out_location, sub_folder))):
+            eeg_dir = join(out_location, sub_folder, session, "eeg")
+            if not session_re.match(session) or (len(sessions) > 0 and session not in sessions) or not os.path.isdir(eeg_dir):
+                continue
+            for f in sorted(os.listdir(eeg_dir)):
+                file_re = made_reports.report_re.match(f)
+                if file_re:
+                    found.append((join(eeg_dir, f), int(sub_folder[4:]), session, file_re))
+    return found
+
+def index_report(db, path, sub, session, file_re, known):
+    # adds the rows of path the index doesn't have yet, returns how many
+    st = os.stat(path)
+    if known is not None and known[:2] == (st.st_mtime_ns, st.st_size):
+        return 0
+    with open(path, "rb") as f:
+        data = f.read()
+    header = data[:data.find(b"\n") + 1] if b"\n" in data else data
+    columns = next(csv.reader(io.StringIO(header.decode("utf-8-sig", "replace"))), [])
+    # only appended to since the last run if the bytes indexed then are still there unchanged
+    appended = known is not None and len(data) >= known[1] and json.loads(known[2]) == columns
+    if appended and hashlib.sha1(data[:known[1]]).hexdigest() == known[3]:
+        offset = known[1]
+        line = db.execute("select count(*) from reports where file = ?", (path,)).fetchone()[0]
+    else:
+        offset = len(header)
+        line = 0
+        db.execute("delete from reports where file = ?", (path,))
+    body = data[offset:].decode("utf-8", "replace")
+    existing = _columns(db)
+    for col in columns:
+        if col not in existing:
+            db.execute('alter table reports add column "' + col.replace('"', '') + '" text')
+            existing.append(col)
+    rows = []
+    for record in csv.reader(io.StringIO(body)):
+        if len(record) == 0 or all(value.strip() == "" for value in record):
+            continue
+        line += 1
+        # a row cut short (a run killed while writing its report) keeps the fields it has, the rest are NULL
+        values = dict(zip(columns, record))
+        row = [sub, file_re.group(1), session, file_re.group(2), file_re.group(3) or None,
+               int(file_re.group(4) is not None), _timestamp(values.get("date_processed")), path, line]
+        rows.append(row + [_typed(values.get(col, ""), FIELD_TYPES.get(col, "TEXT")) for col in columns])
+    if len(rows) > 0:
+        names = ", ".join(KEY_COLUMNS + ['"' + col.replace('"', '') + '"' for col in columns])
+        marks = ", ".join("?" * (len(KEY_COLUMNS) + len(columns)))
+        db.executemany("insert into reports (" + names + ") values (" + marks + ")", rows)
+    db.execute("insert or replace into report_files values (?, ?, ?, ?, ?)",
+               (path, st.st_mtime_ns, len(data), json.dumps(columns), hashlib.sha1(data).hexdigest()))
+    return len(rows)
+
+if __name__ == "__main__":
+    dataset = sys.argv[1]
+    sessions = sys.argv[2:]
+
+    dataset_path = join("/home/data/NDClab/datasets", dataset)
+    out_location = join(dataset_path, "derivatives", "preprocessed")
+    db = connect(index_path(dataset_path))
+    known = {row[0]: row[1:] for row in db.execute("select file, mtime_ns, size, columns, digest from report_files")}
+    added = 0
+    with db:
+        seen = set()
+        for path, sub, session, file_re in report_files(out_location, sessions):
+            seen.add(path)
+            added += index_report(db, path, sub, session, file_re, known.get(path))
+        # reports that are gone, only within the sessions indexed this time
+        for path in known:
+            in_scope = len(sessions) == 0 or any(os.sep + session + os.sep in path for session in sessions)
+            if path not in seen and in_scope:
+                db.execute("delete from reports where file = ?", (path,))
+                db.execute("delete from report_files where file = ?", (path,))
+    total = db.execute("select count(*) from reports").fetchone()[0]
+    db.close()
+    print("Indexed " + str(added) + " new report rows, " + str(total) + " in " + index_path(dataset_path))
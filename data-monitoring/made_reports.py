@@ -0,0 +1,118 @@
+import csv
+import io
+import json
+import os
+import re
+import tempfile
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from os.path import join
+
+# Collects the most recent record of every MADE_preprocessing_report_*.csv under
+# derivatives/preprocessed/sub-#/<session>/eeg. MADE_pipeline.m appends one row per run,
+# so only the header and the last line of a report are read (from the end of the file),
+# subject folders are read on a thread pool, and reports whose (mtime, size) haven't
+# changed since the last harvest are taken from a cache in data-monitoring/.cache.
+
+report_re = re.compile('^MADE_preprocessing_report_(.+?)_(s[0-9]+_r[0-9]+_e[0-9]+)(.*?)?(_ERROR_incomplete)?\\.csv$')
+FIELDS = ["total_epochs_after_artifact_rejection", "any_usable_data"]
+CACHE_VERSION = 1
+
+# error is True for _ERROR_incomplete reports; values are the FIELDS of the last record
+Report = namedtuple("Report", ["sub", "task", "error", "values"])
+
+_tail_bytes = 8 * 1024
+
+def cache_path(dataset_path, session):
+    return join(dataset_path, "data-monitoring", ".cache", "made-reports_" + session + ".json")
+
+def parse_value(text):
+    # numbers as read_csv would give them, blanks as None
+    text = text.strip()
+    if text == "" or text == "NaN":
+        return None
+    for kind in (int, float):
+        try:
+            return kind(text)
+        except ValueError:
+            pass
+    return text
+
+def last_record(path):
+    # {column: value} of the last non-empty line of a CSV, reading its header and its tail only
+    with open(path, "rb") as f:
+        header = f.readline()
+        start = f.tell()
+        end = f.seek(0, os.SEEK_END)
+        tail = b""
+        pos = end
+        # grow the tail until it holds the whole last line (or everything after the header)
+        while pos > start:
+            pos = max(start, pos - _tail_bytes)
+            f.seek(pos)
+            tail = f.read(end - pos)
+            if b"\n" in tail.rstrip(b"\r\n") or pos == start:
+                break
+    lines = [line for line in tail.decode("utf-8", "replace").splitlines() if line.strip() != ""]
+    if len(lines) == 0:
+        return dict()
+    columns = next(csv.reader(io.StringIO(header.decode("utf-8-sig", "replace"))), [])
+    record = next(csv.reader(io.StringIO(lines[-1])), [])
+    return {col: parse_value(val) for col, val in zip(columns, record)}
+
+def _subject_reports(eeg_dir, sub, known):
+    # [(Report, cache entry)] for the reports in one subject's eeg folder
+    found = []
+    with os.scandir(eeg_dir) as it:
+        entries = sorted((entry for entry in it if entry.is_file()), key=lambda entry: entry.name)
+    for entry in entries:
+        file_re = report_re.match(entry.name)
+        if not file_re:
+            continue
+        st = entry.stat()
+        cached = known.get(entry.path)
+        if cached is not None and cached[:2] == [st.st_mtime_ns, st.st_size]:
+            values = cached[2]
+        else:
+            record = last_record(entry.path)
+            values = {field: record.get(field) for field in FIELDS}
+        found.append((Report(sub, file_re.group(1), file_re.group(4) is not None, values),
+                      (entry.path, [st.st_mtime_ns, st.st_size, values])))
+    return found
+
+class Harvester:
+    def __init__(self, dataset_path, session, jobs=None):
+        self.out_location = join(dataset_path, "derivatives", "preprocessed")
+        self.session = session
+        self.path = cache_path(dataset_path, session)
+        self.jobs = jobs or min(8, os.cpu_count() or 1)
+        self.entries = dict() # report path -> [mtime_ns, size, values]
+        try:
+            with open(self.path) as f:
+                cache = json.load(f)
+            if cache.get("version") == CACHE_VERSION:
+                self.entries = cache["reports"]
+        except (OSError, ValueError, KeyError, AttributeError):
+            self.entries = dict()
+
+    def reports(self):
+        # Report for every MADE report of the session, in subject and file name order
+        folders = []
+        for sub_folder in sorted(os.listdir(self.out_location)):
+            eeg_dir = join(self.out_location, sub_folder, self.session, "eeg")
+            if sub_folder.startswith("sub-") and os.path.isdir(eeg_dir):
+                folders.append((eeg_dir, int(sub_folder[4:])))
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            found = [item for items in pool.map(lambda folder: _subject_reports(folder[0], folder[1], self.entries), folders) for item in items]
+        self.entries = dict(entry for _, entry in found)
+        return [report for report, _ in found]
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), prefix=".made-reports_")
+            with os.fdopen(fd, "w") as f:
+                json.dump({"version": CACHE_VERSION, "reports": self.entries}, f)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass # reports are just read again next time
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+import sys
+import math
+import os
+import re
+import heapq
+from glob import glob
+from os.path import join, isdir
+
+import subjects_yet_to_process
+
+# Packs the subjects still waiting for EEG preprocessing into balanced SLURM batches.
+# Each subject's cost is the time MADE_pipeline.m last took on it when a preprocess log
+# has it, otherwise its .eeg size times the dataset's hours per byte seen in those logs.
+# Subjects are spread over (batches x cpus) workers longest-first (LPT), and every batch
+# gets a walltime from its most loaded worker instead of a flat 10 hours per 4 subjects.
+#
+# usage: plan_preprocessing.py <dataset> [--cpus N] [--max-hours H] [session ...]
+# prints one batch per line: <session>:<sub/sub/...> <cpus> <mem> <walltime>
+
+class c:
+    RED = '\033[31m'
+    GREEN = '\033[32m'
+    ENDC = '\033[0m'
+    BOLD = '\033[1m'
+    UNDERLINE = '\033[4m'
+
+DEFAULT_HOURS = 10.0 # per subject of median size when no preprocess log has timings yet
+MEM_PER_CPU_GB = 10
+MARGIN = 1.25 # walltime slack over the estimated load
+STARTUP_HOURS = 0.5 # container, matlab and parpool start, redcap scoring
+
+# printed by MADE_pipeline.m at the end of each subject, captured in preprocess.sub-<jobid>.out
+completed_re = re.compile('MADE pipeline completed for subject sub-([0-9]+) in ([0-9]+) hours ([0-9.]+) minutes')
+
+def eeg_bytes(dataset_path, session, sub):
+    return sum(os.path.getsize(f) for f in glob(join(dataset_path, "sourcedata", "raw", session, "eeg", "sub-" + sub, "*.eeg")))
+
+def past_hours(dataset_path):
+    # {sub: hours} of the most recent completed run of each subject in the preprocess logs
+    hours = dict()
+    logs = glob(join(dataset_path, "data-monitoring", "preprocess.sub-*.out"))
+    for log in sorted(logs, key=os.path.getmtime):
+        with open(log, errors="replace") as f:
+            for line in f:
+                done = completed_re.search(line)
+                if done:
+                    hours[done.group(1)] = int(done.group(2)) + float(done.group(3)) / 60
+    return hours
+
+def hours_per_byte(dataset_path, history, sessions):
+    # total hours over total .eeg bytes of the subjects with a recorded run
+    total_hours = total_bytes = 0
+    for sub, hours in history.items():
+        sizes = [eeg_bytes(dataset_path, session, sub) for session in sessions]
+        sizes = [size for size in sizes if size > 0]
+        if len(sizes) > 0:
+            total_hours += hours
+            total_bytes += sum(sizes) / len(sizes)
+    return total_hours / total_bytes if total_bytes > 0 else None
+
+def lpt(costs, workers):
+    # longest processing time first: each subject, largest first, goes to the least loaded worker
+    heap = [(0.0, i) for i in range(workers)]
+    assigned = [[] for _ in range(workers)]
+    loads = [0.0] * workers
+    for sub, cost in sorted(costs.items(), key=lambda item: (-item[1], item[0])):
+        load, i = heapq.heappop(heap)
+        assigned[i].append(sub)
+        loads[i] = load + cost
+        heapq.heappush(heap, (loads[i], i))
+    return assigned, loads
+
+def pack(costs, cpus, max_hours):
+    # [(subjects, cpus, hours)]: the fewest batches whose busiest worker fits in max_hours
+    if len(costs) == 0:
+        return []
+    batches = max(1, math.ceil(sum(costs.values()) / (cpus * max_hours)))
+    while True:
+        assigned, loads = lpt(costs, batches * cpus)
+        if max(loads) <= max_hours or batches * cpus >= len(costs):
+            break
+        batches += 1
+    packed = []
+    for b in range(batches):
+        workers = range(b * cpus, (b + 1) * cpus)
+        subs = [sub for i in workers for sub in assigned[i]]
+        if len(subs) == 0:
+            continue
+        # parfor hands out subjects roughly in order, so the largest go first
+        subs.sort(key=lambda sub: -costs[sub])
+        packed.append((subs, min(cpus, len(subs)), max(loads[i] for i in workers)))
+    return packed
+
+def walltime(hours):
+    return str(math.ceil(hours * MARGIN + STARTUP_HOURS)) + ":00:00"
+
+if __name__ == "__main__":
+    dataset = sys.argv[1]
+    args = sys.argv[2:]
+    cpus = 4
+    max_hours = 48.0
+    sessions = []
+    while len(args) > 0:
+        arg = args.pop(0)
+        if arg == "--cpus":
+            cpus = int(args.pop(0))
+        elif arg == "--max-hours":
+            max_hours = float(args.pop(0))
+        else:
+            sessions.append(arg)
+    dataset_path = join(subjects_yet_to_process.datasets_root, dataset)
+    raw = join(dataset_path, "sourcedata", "raw")
+    all_sessions = sorted(s for s in os.listdir(raw) if isdir(join(raw, s)))
+    if len(sessions) == 0:
+        sessions = all_sessions
+
+    history = past_hours(dataset_path)
+    rate = hours_per_byte(dataset_path, history, all_sessions)
+    for session in sessions:
+        subs = subjects_yet_to_process.unprocessed_subjects(dataset, session)
+        sizes = {sub: eeg_bytes(dataset_path, session, sub) for sub in subs}
+        if rate is None and len(sizes) > 0:
+            # no timings yet: DEFAULT_HOURS for a subject of median size, scaled by size
+            median = sorted(sizes.values())[len(sizes) // 2]
+            rate = DEFAULT_HOURS / median if median > 0 else None
+        costs = dict()
+        for sub in subs:
+            if sub in history:
+                costs[sub] = history[sub]
+            elif rate is not None and sizes[sub] > 0:
+                costs[sub] = sizes[sub] * rate
+            else:
+                costs[sub] = DEFAULT_HOURS
+        for batch_subs, batch_cpus, hours in pack(costs, cpus, max_hours):
+            if hours > max_hours:
+                print(c.RED + "Warning: subject " + batch_subs[0] + " alone is estimated at " + "{:.1f}".format(hours) + " hours, more than --max-hours " + str(max_hours) + c.ENDC, file=sys.stderr)
+            print(session + ":" + "/".join(batch_subs), batch_cpus, str(batch_cpus * MEM_PER_CPU_GB) + "G", walltime(hours))
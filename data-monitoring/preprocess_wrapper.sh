@@ -2,11 +2,13 @@
 
 usage() {
   cat <<EOF
-  Usage: $0 [-s session:user1/user2,session:user1/user2 ] [-n session:user1/user2,session:user1/user2 ] [-c numcpus ] [-r] [-d]
+  Usage: $0 [-s session:user1/user2,session:user1/user2 ] [-n session:user1/user2,session:user1/user2 ] [-c numcpus ] [-b] [-r] [-d]
 
   -s subjects and sessions to process, sessions separated by commas and users separated by slashes
   -n subjects and sessions not to process
   -c number cpus requested
+  -b submit the unprocessed subjects as balanced batches sized from past run times (see plan_preprocessing.py),
+     then one job that scores redcap data and updates the tracker once every batch has ended
   -r just score redcap data, no EEG
   -d just score redcap data, no EEG, don't update central tracker
 
@@ -25,7 +27,7 @@ EOF
 exit 0
 }
 
-while getopts "s:n:rdc:" opt; do
+while getopts "s:n:rdc:b" opt; do
   case "${opt}" in
     s)
       sstr=${OPTARG}
@@ -45,6 +47,9 @@ while getopts "s:n:rdc:" opt; do
     c)
       cpus=${OPTARG}
       ;;
+    b)
+      balanced=true
+      ;;
     *)
       usage
       ;;
@@ -62,12 +67,43 @@ if [[ -n $subs_to_process ]] && [[ -n $subs_not_to_process ]]
   exit 0
 fi
 
+if [[ -n "$balanced" ]] && [[ -n $subs_to_process || -n $subs_not_to_process || -n "$score_only" ]]
+  then
+  echo "The -b flag plans every unprocessed subject, it can't be combined with -s, -n, -r or -d."
+  exit 1
+fi
+
 dataset=$(dirname $(pwd))
 project=$(basename $dataset)
 sessions=($(find ${dataset}/sourcedata/raw -mindepth 1 -maxdepth 1 -type d -printf "%f\n"))
 
 sing_image="/home/data/NDClab/tools/instruments/containers/singularity/inst-container.simg"
 
+if [[ -n "$balanced" ]]
+  then
+  # one job per batch, each with its own cpus, memory and walltime
+  batches=$(singularity exec -e $sing_image python3 plan_preprocessing.py $project --cpus $cpus) #need container for pandas
+  job_ids=()
+  batch_sessions=()
+  while read batch batch_cpus batch_mem batch_time; do
+    [[ -z $batch ]] && continue
+    echo "submitting ${batch} with ${batch_cpus} cpus, ${batch_mem} memory, ${batch_time} walltime"
+    job_ids+=($(sbatch --parsable --mem=${batch_mem} --time=${batch_time} --cpus-per-task=$batch_cpus --account=iacc_gbuzzell --partition=highmem1 --qos=highmem1 --export=ALL,sstr=${batch},made_only=true preprocess.sub | cut -d";" -f1))
+    batch_sessions+=($(echo $batch | cut -d':' -f1))
+  done <<< "$batches"
+  if [[ ${#job_ids[@]} -eq 0 ]]
+    then
+    echo "No unprocessed subjects, nothing submitted."
+    exit 0
+  fi
+  # scoring, tracker and report index updates once, after every batch ended however it ended
+  post_sessions=$(printf "%s\n" ${batch_sessions[@]} | sort -u | paste -sd'/')
+  dependency=$(IFS=':'; echo "${job_ids[*]}")
+  echo "submitting tracker update for ${post_sessions} after jobs ${dependency}"
+  sbatch --dependency=afterany:${dependency} --mem=1G --time=00:30:00 --export=ALL,post=${post_sessions} preprocess.sub
+  exit 0
+fi
+
 totalsubs=0
 if [[ -n $subs_to_process ]]
    then
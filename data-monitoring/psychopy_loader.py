@@ -0,0 +1,52 @@
+import csv
+
+import pandas as pd
+
+# Reads only what behavioral QA needs from a PsychoPy output CSV: the header is read on
+# its own to tell task CSVs (those with a task_blockText.started column) from the other
+# outputs, then only the trial columns are parsed, with explicit dtypes, using the
+# pyarrow engine when it is installed.
+
+start_column = "task_blockText.started"
+TRIAL_COLUMNS = {start_column: "float64", "middleStim": "object", "conditionText": "object"}
+conditions = ["Observed", "Alone"]
+
+try:
+    import pyarrow # noqa: F401
+    _pyarrow = tuple(int(v) for v in pd.__version__.split(".")[:2]) >= (1, 4)
+except ImportError:
+    _pyarrow = False
+
+def read_header(path):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        return next(csv.reader(f), [])
+
+def is_task_csv(path):
+    return start_column in read_header(path)
+
+def _read_csv(path, **kwargs):
+    if _pyarrow:
+        try:
+            frame = pd.read_csv(path, engine="pyarrow", **kwargs)
+        except ValueError:
+            frame = None # options or values the pyarrow engine can't handle, use the default parser
+        if frame is not None:
+            # pyarrow reads an empty text field as "" where the default parser gives NaN
+            text = frame.select_dtypes("object").columns
+            frame[text] = frame[text].where(frame[text] != "")
+            return frame
+    return pd.read_csv(path, **kwargs)
+
+def read_trial_columns(path):
+    # the trial columns of a task CSV; raises like read_csv would when one of them is missing
+    try:
+        return _read_csv(path, usecols=list(TRIAL_COLUMNS), dtype=TRIAL_COLUMNS)
+    except ValueError:
+        return _read_csv(path, usecols=list(TRIAL_COLUMNS)) # non-numeric start times, or a missing column raises again
+
+def count_trials(path):
+    # Observed/Alone trials with a middleStim from the first block start on
+    psychopy_data = read_trial_columns(path)
+    start_index = psychopy_data.loc[:, start_column].first_valid_index()
+    psychopy_data = psychopy_data.iloc[start_index:, :].dropna(subset = ["middleStim"])
+    return int(psychopy_data["conditionText"].isin(conditions).sum())
@@ -0,0 +1,61 @@
+import csv
+
+import pandas as pd
+
+# Reads each REDCap export at most once per process: the header is read on its own to
+# find id and duplicate columns, then only the columns a script asks for are loaded
+# (completion columns as float32) and the frame is kept for every later consumer.
+
+completed = "_complete"
+
+try:
+    import pyarrow # noqa: F401
+    _pyarrow = tuple(int(v) for v in pd.__version__.split(".")[:2]) >= (1, 4)
+except ImportError:
+    _pyarrow = False
+
+_headers = dict() # path -> [column names]
+_frames = dict() # path -> DataFrame with every column loaded so far
+
+def read_header(path):
+    if path not in _headers:
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            _headers[path] = next(csv.reader(f), [])
+    return _headers[path]
+
+def duplicate_columns(path):
+    counts = pd.Series([col for col in read_header(path) if col != ""], dtype=object).value_counts()
+    return [col for col in counts.keys() if counts[col] > 1]
+
+def id_column(path, prefix):
+    # last header column starting with prefix (e.g. "record_id" or "<id>_s1_r1_e1"), or None
+    matches = [col for col in read_header(path) if col.startswith(prefix)]
+    return matches[-1] if len(matches) > 0 else None
+
+def _read_csv(path, **kwargs):
+    if _pyarrow:
+        try:
+            frame = pd.read_csv(path, engine="pyarrow", **kwargs)
+        except ValueError:
+            frame = None # options or values the pyarrow engine can't handle, use the default parser
+        if frame is not None:
+            # pyarrow reads an empty text field as "" where the default parser gives NaN
+            text = frame.select_dtypes("object").columns
+            frame[text] = frame[text].where(frame[text] != "")
+            return frame
+    return pd.read_csv(path, **kwargs)
+
+def read_redcap(path, columns):
+    # DataFrame with the requested columns that exist in the export, in file order
+    header = read_header(path)
+    wanted = set(columns).intersection(header)
+    cached = _frames.get(path)
+    if cached is None or not wanted.issubset(cached.columns):
+        usecols = wanted if cached is None else wanted.union(cached.columns)
+        dtypes = {col: "float32" for col in usecols if col.endswith(completed)}
+        try:
+            cached = _read_csv(path, usecols=list(usecols), dtype=dtypes)
+        except ValueError:
+            cached = _read_csv(path, usecols=list(usecols)) # non-numeric completion values
+        _frames[path] = cached
+    return cached.loc[:, [col for col in cached.columns if col in wanted]]
@@ -5,6 +5,8 @@ from glob import glob
 import re
 from datetime import datetime
 
+import psychopy_loader
+
 r_name = "Lilly"
 dtype = "psychopy"
 dataset_path = "/home/data/NDClab/datasets/thrive-dataset/sourcedata/pending-qa/" # mofify if your behavioral data is in another folder
@@ -55,14 +57,11 @@ for row_num, path in enumerate(subject_data_paths):
                 found_extensions[ext] = True
         if sum([item[1] for item in list(found_extensions.items())]) == 3: # ideal case, all 3 files are correct extension
             try:
-                psychopy_data = pd.read_csv(glob(f"{subject_folder}*.csv")[0])
-                start_index = psychopy_data.loc[:, "task_blockText.started"].first_valid_index()
-                psychopy_data = psychopy_data.iloc[start_index:, :].dropna(subset = ["middleStim"])
-                psychopy_data = psychopy_data[psychopy_data["conditionText"].isin(["Observed", "Alone"])].reset_index(drop=True) # check num of trials
-                if psychopy_data.shape[0] == all_trial_count:
+                trial_count = psychopy_loader.count_trials(glob(f"{subject_folder}*.csv")[0]) # check num of trials
+                if trial_count == all_trial_count:
                     print(f"sub-{sub} has ALL trial data! PASSED!")
                     csv_log.loc[row_num, "status"] = "PASSED"
-                elif psychopy_data.shape[0] < all_trial_count and psychopy_data.shape[0] > some_trial_count:
+                elif trial_count < all_trial_count and trial_count > some_trial_count:
                     print(f"sub-{sub} has SOME trial data! FAILED!")
                     csv_log.loc[row_num, "status"] = "FAILED"
                     csv_log.loc[row_num, "notes"] = "NO/NOT ENOUGH TRIALS"
@@ -88,12 +87,8 @@ for row_num, path in enumerate(subject_data_paths):
             sub_csv_files = sorted(glob(f"{subject_folder}*.csv"))
             for csv_fname in sub_csv_files:
                 try:
-                    psychopy_data = pd.read_csv(csv_fname)
-                    if "task_blockText.started" in list(psychopy_data.columns): # count trials from only task-related csv
-                        start_index = psychopy_data.loc[:, "task_blockText.started"].first_valid_index()
-                        psychopy_data = psychopy_data.iloc[start_index:, :].dropna(subset = ["middleStim"])
-                        psychopy_data = psychopy_data[psychopy_data["conditionText"].isin(["Observed", "Alone"])].reset_index(drop=True) # check num of trials
-                        sub_trial_count += psychopy_data.shape[0]
+                    if psychopy_loader.is_task_csv(csv_fname): # count trials from only task-related csv
+                        sub_trial_count += psychopy_loader.count_trials(csv_fname)
                     else:
                         pass # skip if not task-related csv
                 except:
@@ -0,0 +1,72 @@
+import hashlib
+import json
+import os
+import tempfile
+from os.path import abspath, join
+
+import pandas as pd
+
+# Remembers what update-tracker.py saw on its last run for one session: the signature of
+# every checked/sub-#/<session>/<datatype> folder and a hash of the REDCap records behind
+# each tracker ID. The next run only recomputes the tracker rows and columns whose
+# inputs changed since then; update-tracker.py --full ignores the manifest.
+
+# bump whenever the manifest layout changes so old manifests force a full rebuild
+MANIFEST_VERSION = 1
+
+def manifest_path(dataset, session):
+    return join(dataset, "data-monitoring", ".cache", "tracker-manifest_" + (session or "none") + ".json")
+
+def new_manifest(plan_digest, checked_path, child):
+    # dirs: {"<sub>/<datatype>": [mtime_ns, size, [names]]}, redcaps: {redcap: {"columns": [...], "records": {id: digest}}}
+    return {"version": MANIFEST_VERSION, "plan": plan_digest, "checked": abspath(checked_path),
+            "child": child, "subjects": [], "dirs": {}, "redcaps": {}}
+
+def load_manifest(path, plan_digest, checked_path, child):
+    # previous manifest, or None when there is none or it was written for other inputs
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    expected = new_manifest(plan_digest, checked_path, child)
+    for field in ["version", "plan", "checked", "child"]:
+        if manifest.get(field) != expected[field]:
+            return None
+    return manifest
+
+def save_manifest(path, manifest):
+    # written only after the tracker, so a failed run recomputes everything it touched
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tracker-manifest_")
+        with os.fdopen(fd, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass # a read-only dataset still works, the next run is just a full rebuild
+
+def dir_key(sub, datatype):
+    return str(sub) + "/" + datatype
+
+def record_hashes(rc_df, subject_ids):
+    # {tracker ID: digest of every REDCap row that maps to it}. subject_ids is a list of
+    # Series aligned with rc_df rows, one per way a row can map to a tracker ID (own ID,
+    # child ID of a parent record, ...); unmapped rows are NA and ignored
+    row_hashes = pd.util.hash_pandas_object(rc_df, index=True).to_numpy()
+    rows_by_subject = dict()
+    for ids in subject_ids:
+        for pos, subj in enumerate(ids.tolist()):
+            if not pd.isna(subj):
+                rows_by_subject.setdefault(str(int(subj)), set()).add(pos)
+    hashes = dict()
+    for subj, rows in rows_by_subject.items():
+        digest = hashlib.sha1()
+        for row_hash in sorted(int(row_hashes[pos]) for pos in rows):
+            digest.update(row_hash.to_bytes(8, "little"))
+        hashes[subj] = digest.hexdigest()
+    return hashes
+
+def changed_keys(old, new):
+    # keys added, removed or with a different value between two {key: value} dicts
+    return {key for key in set(old) | set(new) if old.get(key) != new.get(key)}
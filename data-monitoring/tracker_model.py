@@ -0,0 +1,211 @@
+import io
+import os
+import tempfile
+from os.path import abspath, basename, dirname, splitext
+
+import numpy as np
+import pandas as pd
+
+# Typed in-memory central tracker. The CSV mixes "1"/"0", 1.0/0.0, "NA" and blanks, so
+# read_csv leaves most columns as float or object and every script compared cells its
+# own way. Here the ID is an int64 index, flag and count columns are nullable integers
+# (Int8 when they fit) and columns holding text such as "NA" are categoricals of strings.
+#
+# The CSV is written back exactly as the scripts wrote it before the model: a cell set
+# during the run is written as it was assigned (update-tracker's "1"/"0"/"NA" text
+# without ".0", numbers as pandas would store them in that column) and every other cell
+# as read_csv typed its column on disk (1.0 in float columns, text as it was read). To do
+# that, read_tracker keeps the on-disk column types in tracker_df.attrs and set_cells
+# records the cells it sets there.
+
+def _is_typed(dtype):
+    return isinstance(dtype, (pd.Int8Dtype, pd.Int64Dtype, pd.CategoricalDtype))
+
+def typed_column(column):
+    # nullable integer column when every value is a whole number, categorical of strings
+    # when text is mixed in, float otherwise; "" counts as missing
+    if _is_typed(column.dtype):
+        return column
+    if pd.api.types.is_numeric_dtype(column.dtype) and not pd.api.types.is_bool_dtype(column.dtype):
+        numbers = column.astype("float64")
+    else:
+        values = column.astype(object)
+        values = values.where(values.notna() & (values != ""), np.nan)
+        numbers = pd.to_numeric(values, errors="coerce")
+        text = values.notna() & numbers.isna()
+        if text.any():
+            strings = values.astype(str)
+            return pd.Series(pd.Categorical(strings.where(values.notna(), np.nan)), index=column.index)
+    present = numbers.to_numpy()
+    present = present[~np.isnan(present)]
+    if (present % 1 != 0).any():
+        return numbers
+    if len(present) == 0 or (present.min() >= -128 and present.max() <= 127):
+        return numbers.astype("Int8")
+    return numbers.astype("Int64")
+
+def typed(tracker_df):
+    # every column through typed_column, and the ID index as int64 when no ID is missing;
+    # columns that are already typed are kept as they are
+    retype = [col for col in tracker_df.columns if not _is_typed(tracker_df[col].dtype)]
+    if len(retype) > 0:
+        columns = {col: tracker_df[col].array for col in tracker_df.columns}
+        for col in retype:
+            columns[col] = typed_column(tracker_df[col]).array
+        attrs = tracker_df.attrs
+        tracker_df = pd.DataFrame(columns, index=tracker_df.index, columns=tracker_df.columns)
+        tracker_df.attrs = attrs
+    if tracker_df.index.notna().all() and pd.api.types.is_numeric_dtype(tracker_df.index) and tracker_df.index.dtype != "int64":
+        tracker_df.index = tracker_df.index.astype("int64")
+    tracker_df.index.name = "id"
+    return tracker_df
+
+def read_tracker(path):
+    raw = pd.read_csv(path, index_col="id")
+    tracker_df = typed(raw)
+    # how read_csv typed the file: "f" float, "i" integer, anything else text kept as read
+    tracker_df.attrs = {"kinds": {col: raw[col].dtype.kind for col in raw.columns},
+                        "id_kind": raw.index.dtype.kind, "ids": raw.index,
+                        "text": {col: raw[col] for col in raw.columns if raw[col].dtype.kind not in "fi"},
+                        "set_text": dict(), "set_number": dict()}
+    return tracker_df
+
+def add_subjects(tracker_df, ids):
+    # empty rows for ids, as appending them to the frame read from disk would add
+    added = typed(pd.concat([tracker_df, pd.DataFrame(index=pd.Index(ids, name="id"))]))
+    added.attrs = tracker_df.attrs
+    return added
+
+def mark_set(tracker_df, col, ids, text=False):
+    # record ids as set in col during this run, see set_cells
+    if "set_text" in tracker_df.attrs:
+        tracker_df.attrs["set_text" if text else "set_number"].setdefault(col, set()).update(ids)
+
+def _replace(path, write):
+    # write(f) into a temp file next to path, then rename it over path so a crash or a
+    # concurrent reader never sees a half-written file; the old file's permissions are kept
+    fd, tmp_path = tempfile.mkstemp(dir=dirname(abspath(path)), prefix="." + basename(path) + ".")
+    try:
+        with os.fdopen(fd, "w", newline="") as f:
+            write(f)
+        if os.path.exists(path):
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+        else:
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp_path, 0o666 & ~umask)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def _float_text(numbers):
+    # numbers as to_csv writes a float column
+    return np.asarray(numbers, dtype="float64").astype(str)
+
+def _int_text(numbers):
+    numbers = np.asarray(numbers, dtype="float64")
+    whole = numbers % 1 == 0
+    text = numbers.astype(str)
+    text[whole] = numbers[whole].astype("int64").astype(str)
+    return text
+
+def _column_text(values, as_int):
+    # str of every present cell, numbers through _int_text or _float_text
+    text = values.astype(object).where(values.notna(), "").astype(str).to_numpy(dtype=object)
+    numbers = pd.to_numeric(values.astype(object), errors="coerce").to_numpy(dtype="float64")
+    is_number = ~np.isnan(numbers)
+    if is_number.any():
+        text[is_number] = (_int_text if as_int else _float_text)(numbers[is_number])
+    return text
+
+def as_written(tracker_df):
+    # the tracker as the CSV text of every cell, see the top of this file
+    attrs = tracker_df.attrs
+    kinds = attrs.get("kinds", dict())
+    index = tracker_df.index
+    # rows added to a frame read from disk turn its integer columns into floats
+    grown = "ids" in attrs and not index.isin(attrs["ids"]).all()
+    cells = dict()
+    for col in tracker_df.columns:
+        values = tracker_df[col].astype(object)
+        kind = kinds.get(col, "f" if "kinds" in attrs else None)
+        if kind == "i" and grown:
+            kind = "f"
+        if kind is None:
+            text = _column_text(values, as_int=True) # not read from disk: integers without ".0"
+        elif kind in "fi":
+            text = _column_text(values, as_int=kind == "i")
+        else:
+            read = attrs["text"][col].reindex(index)
+            text = read.where(read.notna(), "").astype(str).to_numpy(dtype=object)
+        set_number = index.isin(list(attrs.get("set_number", dict()).get(col, ())))
+        if set_number.any():
+            text[set_number] = _column_text(values[set_number], as_int=kind != "f")
+        set_text = index.isin(list(attrs.get("set_text", dict()).get(col, ())))
+        if set_text.any():
+            text[set_text] = _column_text(values[set_text], as_int=True)
+        text[values.isna().to_numpy()] = ""
+        cells[col] = text
+    written = pd.DataFrame(cells, index=index, columns=tracker_df.columns)
+    ids = pd.Series(index, dtype=object)
+    written.index = pd.Index(_column_text(ids, as_int=attrs.get("id_kind") != "f"), name=index.name)
+    return written
+
+def tracker_csv(tracker_df):
+    # columns assigned with plain .loc may have been upcast on the way, type them again first
+    buffer = io.StringIO()
+    as_written(typed(tracker_df)).to_csv(buffer)
+    return buffer.getvalue()
+
+def write_tracker(tracker_df, path):
+    text = tracker_csv(tracker_df)
+    _replace(path, lambda f: f.write(text))
+    return text
+
+def viewable(text):
+    # tracker CSV text without blank columns, remaining blanks shown as "NA"; read back the
+    # way the file would be, so a column holding only "NA" counts as blank
+    tracker_df = pd.read_csv(io.StringIO(text), index_col="id")
+    return tracker_df.loc[:, tracker_df.notnull().any(axis=0)].fillna("NA")
+
+def write_outputs(tracker_df, path):
+    # the central tracker and its _viewable.csv, the latter from the tracker text just written
+    text = write_tracker(tracker_df, path)
+    view = viewable(text)
+    _replace(splitext(path)[0] + "_viewable.csv", lambda f: view.to_csv(f))
+
+def _numbers(values):
+    if isinstance(values, str):
+        return False
+    if pd.api.types.is_list_like(values):
+        return pd.api.types.is_numeric_dtype(np.asarray(values).dtype)
+    return pd.api.types.is_number(values)
+
+def set_cells(tracker_df, col, ids, values, text=False):
+    # tracker_df.loc[ids, col] = values whatever the column dtype and values are: the column
+    # is loosened to float (or object for text), updated and typed again. IDs not in the tracker yet are added
+    # as rows, as a scalar .loc assignment would. text=True for cells the script has always
+    # assigned as strings ("1", "0", "NA"), which are written without ".0"
+    mark_set(tracker_df, col, ids, text)
+    for new_id in pd.Index(ids).difference(tracker_df.index):
+        tracker_df.loc[new_id] = np.nan
+    if isinstance(tracker_df[col].dtype if col in tracker_df.columns else None, pd.Int8Dtype) and _numbers(values):
+        small = np.asarray(values, dtype="float64")
+        if ((small % 1 == 0) & (small >= -128) & (small <= 127)).all():
+            tracker_df.loc[ids, col] = small.astype("int8") if small.ndim > 0 else int(small)
+            return
+    column = tracker_df[col] if col in tracker_df.columns else pd.Series(np.nan, index=tracker_df.index)
+    if _numbers(values) and pd.api.types.is_numeric_dtype(column.dtype):
+        column = column.astype("float64")
+    else:
+        column = column.astype(object)
+    column.loc[ids] = values
+    tracker_df[col] = typed_column(column)
+
+def flags(cells, flag=1):
+    # True where a cell (Series or DataFrame) equals flag as a number, missing and text cells are False
+    if isinstance(cells, pd.DataFrame):
+        return pd.DataFrame({col: flags(cells[col], flag) for col in cells.columns}, index=cells.index)
+    return pd.to_numeric(cells.astype(object), errors="coerce").eq(flag)
@@ -1,12 +1,18 @@
 import pandas as pd
+import numpy as np
 import sys
-from os.path import basename, normpath, join, isdir, isfile, splitext
+from os.path import basename, normpath, join, isdir, isfile
 from os import listdir, walk
 import pathlib
 import re
 import math
 import datetime
-from collections import defaultdict
+
+import datadict_plan
+import file_inventory
+import tracker_manifest
+import redcap_loader
+import tracker_model
 
 # list hallMonitor key
 
@@ -19,87 +25,11 @@ class c:
     BOLD = '\033[1m'
     UNDERLINE = '\033[4m'
 
-# TODO: Make this occur once during construction
-def get_redcap_columns(datadict_df):
-    df = datadict_df
-    # filter for prov
-    cols = {}
-    key_counter = defaultdict(lambda: 0)
-    allowed_duplicate_columns = []
-    for _, row in df.iterrows():
-        if row["dataType"] not in ["consent", "assent", "redcap_data"]: #just redcap data
-            continue
-        if isinstance(row["allowedSuffix"], float) and math.isnan(row["allowedSuffix"]):
-            allowed_suffixes = [""]
-        else:
-            allowed_suffixes = row["allowedSuffix"].split(", ")
-            allowed_suffixes = [x for x in allowed_suffixes if x.startswith(session)] # only from same session
-            allowed_suffixes = ["_" + ses for ses in allowed_suffixes]
-        prov = row["provenance"].split(" ")
-        if "file:" in prov and "variable:" in prov:
-            idx = prov.index("file:")
-            rc_filename = prov[idx+1].strip("\";,")
-            idx = prov.index("variable:")
-            rc_variable = prov[idx+1].strip("\";,")
-            if rc_variable == "":
-                rc_variable = row["variable"].lower()
-            if not rc_filename in cols.keys():
-                cols[rc_filename] = {}
-            if "id:" in prov:
-                idx = prov.index("id:")
-                rc_idcol = prov[idx+1].strip("\";,")
-                cols[rc_filename]["id_column"] = rc_idcol
-        else:
-            continue
-        for ses_tag in allowed_suffixes:
-            #var = row["variable"]
-            var = row["variable"]
-            cols[rc_filename][rc_variable + ses_tag + completed] = var + ses_tag
-            key_counter[rc_variable + ses_tag + completed] += 1
-            # also map Sp. surveys to same column name in central tracker if completed
-            surv_match = re.match('^([a-zA-Z0-9\-]+)(_[a-z0-9]{1,2})?(_scrd[a-zA-Z]+)?(_[a-zA-Z]{2,})?$', rc_variable)
-            if surv_match and "redcap_data" in row["dataType"]:
-                surv_version = '' if not surv_match.group(2) else surv_match.group(2)
-                scrd_str = '' if not surv_match.group(3) else surv_match.group(3)
-                multiple_report_tag = '' if not surv_match.group(4) else surv_match.group(4)
-                surv_esp = surv_match.group(1) + 'es' + surv_version + scrd_str + multiple_report_tag + ses_tag
-                cols[rc_filename][surv_esp + completed] = var + ses_tag
-                key_counter[surv_esp + completed] += 1
-            if "consent" in row["dataType"]:
-                cols[rc_filename][rc_variable + "es" + completed] = var
-    for key, value in key_counter.items():
-        if value > 1:
-            allowed_duplicate_columns.append(key)
-    return cols, allowed_duplicate_columns
-
-def get_tasks(datadict_df):
-    df = datadict_df
-    tasks_dict = dict()
-    task_vars = []
-    for _, row in df.iterrows():
-        if not isinstance(row["expectedFileExt"], float):
-            task_vars.append(row["variable"])
-    for _, row in df.iterrows():
-        if row["variable"] in task_vars:
-            if isinstance(row["dataType"], str) and isinstance(row["expectedFileExt"], str):
-                tasks_dict[row["variable"]] = [row["dataType"], row["expectedFileExt"], row["allowedSuffix"]]
-            else:
-                print(c.RED + "Error: Must have dataType, expectedFileExt, and allowedSuffix fields in datadict for ", row["variable"], ", skipping." + c.ENDC)
-    return tasks_dict
-
-def get_IDs(datadict_df):
-    df_dd = datadict_df
-    id_desc = df_dd.set_index("variable").loc["id", "provenance"].split(" ")
-    # ID description column should contain redcap and variable from which to read IDs, in format 'file: "{name of redcap}"; variable: "{column name}"'
-    for i in id_desc:
-        if "file:" in i:
-            idx = id_desc.index(i)+1
-            id_rc = id_desc[idx].strip("\"\';,()")
-        elif "variable:" in i:
-            idx = id_desc.index(i)+1
-            var = id_desc[idx].strip("\"\';,()")
-    if "id_rc" not in locals() or "var" not in locals():
+def get_IDs(plan):
+    # ID provenance in the datadict should contain redcap and variable from which to read IDs, in format 'file: "{name of redcap}"; variable: "{column name}"'
+    if plan.id_source is None:
         sys.exit("Can\'t find redcap column to read IDs from in datadict")
+    id_rc, var = plan.id_source
 
     redcap_files = [join(checked_path,"redcap",f) for f in listdir(join(checked_path,"redcap")) if isfile(join(checked_path,"redcap",f))]
     for redcap in redcap_files:
@@ -118,101 +48,171 @@ def get_IDs(datadict_df):
             
     if "consent_redcap" not in locals():
         sys.exit("Can\'t find" + id_rc + "redcap to read IDs from")
-    consent_redcap = pd.read_csv(consent_redcap, index_col=var)
-    ids = consent_redcap.index.tolist()
+    ids = redcap_loader.read_redcap(consent_redcap, [var])[var].tolist()
     return ids
 
-def get_study_no(datadict_df):
-    allowed_vals = datadict_df.set_index("variable").loc["id", "allowedValues"]
-    allowed_vals = allowed_vals.replace(" ", "")
-    intervals = re.split("[\[\]]", allowed_vals)
-    intervals = list(filter(lambda x: x not in [",", ""], intervals))
-    return intervals[0][0:2] # first two digits should be study no.
-
-def fill_combination_columns(tracker_df, dd_df):
+def fill_combination_columns(tracker_df, plan):
     combos_dict = dict()
-    for _, row in dd_df.iterrows():
-        if row["dataType"] == "combination":
-            idx = row["provenance"].split(" ").index("variables:")
-            vars = "".join(row["provenance"].split(" ")[idx+1:]).split(",")
-            vars = [var.strip("\"") for var in vars]
-            for ses in row["allowedSuffix"].split(", "):
-                combos_dict[row["variable"]+"_"+ses] = [var+"_"+ses for var in vars]
-    for key, cols in combos_dict.items():
-        if len(cols) == 0:
-            print(c.RED + "Error: columns to combine not found for combination variable: " + key + ", can\'t update column." + c.ENDC)
-            del combos_dict[key]
+    for variable, combination in plan.combinations.items():
+        for ses in combination.suffixes:
+            if not ses.startswith(session): # only from same session
+                continue
+            cols = [var+"_"+ses for var in combination.variables]
+            if len(cols) == 0:
+                print(c.RED + "Error: columns to combine not found for combination variable: " + variable+"_"+ses + ", can\'t update column." + c.ENDC)
+                continue
+            combos_dict[variable+"_"+ses] = cols
+    missing_cols = [col for cols in combos_dict.values() for col in cols if col not in tracker_df.columns]
+    if len(missing_cols) > 0:
+        sys.exit(c.RED + "Error: KeyError: " + ", ".join(dict.fromkeys(missing_cols)) + " not found, please fix central tracker." + c.ENDC)
     for combined_col, cols in combos_dict.items():
-        for id, row in tracker_df.iterrows():
-            present = False
-            for col in cols:
-                try:
-                    if str(tracker_df.loc[id, col]) == "1":
-                        present = True
-                except KeyError as e_msg:
-                    sys.exit(c.RED + "Error: KeyError:" + e_msg + ", please fix central tracker." + c.ENDC)
-            if present:
-                tracker_df.loc[id, combined_col] = "1"
-            else:
-                tracker_df.loc[id, combined_col] = "0"
-        if not any(tracker_df.loc[:, combined_col] == "1"):
-            tracker_df.loc[:, combined_col] = "" # all zeros columns leave blank
-
-def parent_columns(datadict_df):
-    parent_info = dict()
-    for _, row in datadict_df.iterrows():
-        if row["dataType"] == "parent_identity":
-            prov = row["provenance"].split(" ")
-            if "file:" in prov and "variable:" in prov:
-                idx = prov.index("file:")
-                rc_filename = prov[idx+1].strip("\";")
-                idx = prov.index("variable:")
-                rc_variable = prov[idx+1].strip("\";")
-                parent_info.setdefault(rc_filename,[]).append(row["variable"])
-            else:
+        # 1 if any source column is 1 for that row; all zeros columns leave blank
+        present = tracker_model.flags(tracker_df[cols]).any(axis=1).to_numpy()
+        if present.any():
+            tracker_df[combined_col] = pd.array(np.where(present, 1, 0), dtype="Int8")
+        else:
+            tracker_df[combined_col] = pd.array([pd.NA] * len(present), dtype="Int8")
+        tracker_model.mark_set(tracker_df, combined_col, tracker_df.index, text=True)
+
+def resolve_parent_ids(rc_ids):
+    # child ID and role for a whole column of REDCap IDs with one str.extract: parent IDs
+    # (study_no + 8 or 9 + XXXX) and child IDs (study_no + 0 + XXXX) both map to child ID
+    # study_no + 0 + XXXX, role is the 0/8/9 digit; IDs matching neither format are NA
+    parts = pd.Series(rc_ids).astype(str).str.extract(study_no + '([089])(\d{4})')
+    child_ids = pd.Series(pd.NA, index=parts.index, dtype="object")
+    matched = parts[1].notna()
+    child_ids[matched] = (study_no + '0' + parts.loc[matched, 1]).astype("int64")
+    return pd.DataFrame({"child_id": child_ids, "role": parts[0]})
+
+def get_child_ids(rc_ids):
+    return resolve_parent_ids(rc_ids)["child_id"]
+
+def set_child_values(col, child_ids, values):
+    # tracker_df.loc[child_id, col] = value for every pair at once, later pairs winning
+    final = dict(zip(child_ids, values))
+    if len(final) == 0:
+        return
+    tracker_model.set_cells(tracker_df, col, list(final.keys()), list(final.values()), text=True)
+
+def map_record_ids(rc_df):
+    # tracker IDs for every record of a REDCap export at once: (record IDs, valid mask, int IDs, tracker IDs)
+    rc_index = pd.Series(rc_df.index)
+    if pd.api.types.is_numeric_dtype(rc_index):
+        valid = rc_index.notna()
+    else:
+        valid = rc_index.map(lambda x: isinstance(x, (int, float)) and not math.isnan(x))
+    ids = rc_index[valid].astype("int64").astype(object).reindex(rc_index.index)
+    if child == 'true':
+        tracker_ids = get_child_ids(ids.where(valid, ""))
+    else:
+        tracker_ids = ids
+    return rc_index, valid, ids, tracker_ids
+
+def update_redcap_columns(tracker_df, rc_df, all_keys, tracker_ids, in_tracker, completed_ids, dirty=None):
+    # set tracker columns from REDCap "_complete" columns: 1 if any record for a subject == 2,
+    # 0 otherwise, never overwriting a 1 already set during this run (completed_ids, tracker
+    # column -> subjects). Subjects outside dirty keep their value from the last run
+    keys_in_redcap = dict()
+    if not in_tracker.any():
+        return keys_in_redcap
+    # records with duplicated IDs are ambiguous and never update the tracker
+    use = in_tracker.to_numpy() & ~rc_df.index.duplicated(keep=False)
+    # a full run sets these cells again with the values they already have
+    unchanged = tracker_ids[use & ~tracker_ids.isin(dirty).to_numpy()].tolist() if dirty is not None else []
+    if dirty is not None:
+        use &= tracker_ids.isin(dirty).to_numpy()
+    row_ids = tracker_ids[use].to_numpy()
+    for key, value in all_keys.items():
+        if key not in rc_df.columns:
+            continue
+        keys_in_redcap[key] = value
+        tracker_model.mark_set(tracker_df, value, unchanged, text=True)
+        if not use.any():
+            continue
+        complete = pd.Series((rc_df[key] == 2).to_numpy()[use], index=row_ids)
+        complete = complete.groupby(level=0, sort=True).any()
+        done = completed_ids.setdefault(value, set())
+        complete = complete[~complete.index.isin(list(done))]
+        if len(complete) > 0:
+            tracker_model.set_cells(tracker_df, value, complete.index.tolist(), np.where(complete, 1, 0), text=True)
+            done.update(complete.index[complete.to_numpy()])
+    return keys_in_redcap
+
+def index_columns(all_rc_headers):
+    # column -> [redcaps whose header has it], built once so every column check is a lookup
+    column_index = dict()
+    for rc_filename, header in all_rc_headers.items():
+        for col in header:
+            rcs = column_index.setdefault(col, [])
+            if rc_filename not in rcs:
+                rcs.append(rc_filename)
+    return column_index
+
+def redcap_column_problems(redcheck_columns, allowed_duplicate_columns, column_index):
+    # every missing, misplaced or disallowed duplicate redcap column, so they can be reported together
+    problems = []
+    for expected_rc, rc_keys in redcheck_columns.items():
+        for key in rc_keys.keys():
+            if key.startswith("consent") or key.startswith("assent") or key.startswith("id_column"):
                 continue
-            rc_df = pd.read_csv(all_redcap_paths[rc_filename])
-            parent_ids = list(rc_df.loc[:, rc_variable])
-            for id in parent_ids:
-                if re.search(study_no + '[089](\d{4})', str(id)):
-                    child_id = study_no + '0' + re.search(study_no + '([089])(\d{4})', str(id)).group(2)
-                    child_id = int(child_id)
-                    parent = re.search(study_no + '([089])(\d{4})', str(id)).group(1)
-                else:
-                    continue
-                try:
-                    for suf in row["allowedSuffix"].split(", "):
-                        if re.match("^" + session + "_e[0-9]+$", suf):
-                            tracker_df.loc[child_id, row["variable"] + "_" + suf] = parent
-                except:
-                    continue
-        elif row["dataType"] == "parent_lang":
-            prov = row["provenance"].split(" ")
-            if "file:" in prov and "variable:" in prov:
-                idx = prov.index("file:")
-                rc_filename = prov[idx+1].strip("\";")
-                idx = prov.index("variable:")
-                rc_variable = prov[idx+1].strip("\";")
-                parent_info.setdefault(rc_filename,[]).append(row["variable"])
-            else:
+            if re.match('^.*es(_[a-zA-Z])?_s[0-9]+_r[0-9]+_e[0-9]+_complete', key):
+                continue
+            found_in = column_index.get(key, [])
+            if expected_rc in found_in:
                 continue
-            rc_df = pd.read_csv(all_redcap_paths[rc_filename], index_col="record_id")
+            if len(found_in) >= 1:
+                problems.append("can\'t find " + key + " in " + expected_rc + " redcap, but found in " + ", ".join(found_in) + " redcaps")
+            else:
+                problems.append("can\'t find " + key + " in " + expected_rc + " redcap")
+    duplicates = []
+    for col, rcs in column_index.items():
+        if col.endswith(completed) and len(rcs) > 1 and col not in allowed_duplicate_columns:
+            duplicates.append(col + " in " + ", ".join(all_redcap_paths[rc] for rc in rcs))
+    if len(duplicates) > 0:
+        problems.append("Duplicate columns were found across Redcaps: " + "; ".join(duplicates))
+    return problems
+
+def parent_rc_columns(plan, rc_filename, header):
+    # REDCap columns parent_columns reads from one export
+    columns = []
+    for spec in plan.parents:
+        if spec.redcap != rc_filename:
+            continue
+        if spec.datatype == "parent_identity":
+            columns.append(spec.rc_variable)
+        elif spec.datatype == "parent_lang":
+            columns.append("record_id")
+            columns.extend(col for col in header if re.match(spec.rc_variable + "_(s[0-9]+_r[0-9]+_e[0-9]+)", col))
+    return columns
+
+def parent_columns(plan):
+    parent_info = dict()
+    for spec in plan.parents:
+        rc_filename = spec.redcap
+        rc_variable = spec.rc_variable
+        parent_info.setdefault(rc_filename,[]).append(spec.variable)
+        suffixes = [suf for suf in spec.suffixes if re.match("^" + session + "_e[0-9]+$", suf)]
+        if spec.datatype == "parent_identity":
+            rc_df = redcap_loader.read_redcap(all_redcap_paths[rc_filename], [rc_variable])
+            parent_ids = resolve_parent_ids(rc_df.loc[:, rc_variable])
+            parent_ids = parent_ids[parent_ids["child_id"].notna()]
+            for suf in suffixes:
+                set_child_values(spec.variable + "_" + suf, parent_ids["child_id"], parent_ids["role"])
+        elif spec.datatype == "parent_lang":
+            rc_path = all_redcap_paths[rc_filename]
+            rc_df = redcap_loader.read_redcap(rc_path, parent_rc_columns(plan, rc_filename, redcap_loader.read_header(rc_path)))
+            rc_df = rc_df.set_index("record_id")
+            child_ids = get_child_ids(rc_df.index)
+            matched = child_ids.notna().to_numpy()
             for col in rc_df.columns:
                 lang_re = re.match(rc_variable + "_(s[0-9]+_r[0-9]+_e[0-9]+)", col)
                 if lang_re:
-                    for _, rc_row in rc_df.iterrows():
-                        if re.search(study_no + '[089](\d{4})', str(rc_row.name)):
-                            child_id = study_no + '0' + re.search(study_no + '([089])(\d{4})', str(rc_row.name)).group(2)
-                            child_id = int(child_id)
-                            if str(rc_row[col]) == "1" or str(rc_row[col]) == "2":
-                                try:
-                                    for suf in row["allowedSuffix"].split(", "):
-                                        if re.match("^" + session + "_e[0-9]+$", suf):
-                                            tracker_df.loc[child_id, row["variable"] + "_" + suf] = str(rc_row[col])
-                                except:
-                                    continue
-                            else:
-                                print("Error: unknown value seen for parent language, should be 1 for English and 2 for Spanish.")
+                    langs = rc_df[col].astype(str).to_numpy()
+                    valid = matched & np.isin(langs, ["1", "2"])
+                    for _ in range(np.count_nonzero(matched & ~valid)):
+                        print("Error: unknown value seen for parent language, should be 1 for English and 2 for Spanish.")
+                    for suf in suffixes:
+                        set_child_values(spec.variable + "_" + suf, child_ids[valid], langs[valid])
     return parent_info
 
 if __name__ == "__main__":
@@ -221,6 +221,7 @@ if __name__ == "__main__":
     redcaps = sys.argv[3]
     session = sys.argv[4]
     child = sys.argv[5]
+    full = "--full" in sys.argv[6:] # ignore the manifest and recompute every tracker cell
 
     redcaps = redcaps.split(',')
     if session == "none":
@@ -230,34 +231,42 @@ if __name__ == "__main__":
       ses_tag = "_" + session
 
     DATA_DICT = dataset + "/data-monitoring/data-dictionary/central-tracker_datadict.csv"
-    df_dd = pd.read_csv(DATA_DICT)
-    redcheck_columns, allowed_duplicate_columns = get_redcap_columns(df_dd)
-    tasks_dict = get_tasks(df_dd)
-    ids = get_IDs(df_dd)
-    study_no = get_study_no(df_dd)
+    plan = datadict_plan.load_plan(DATA_DICT)
+    redcheck_columns, allowed_duplicate_columns = plan.redcap_columns(session)
+    for var in plan.invalid_tasks:
+        print(c.RED + "Error: Must have dataType, expectedFileExt, and allowedSuffix fields in datadict for ", var, ", skipping." + c.ENDC)
+    tasks_dict = plan.tasks
+    ids = get_IDs(plan)
+    study_no = plan.study_no
     
     # extract project path from dataset
     proj_name = basename(normpath(dataset))
 
     data_tracker_file = "{}/data-monitoring/central-tracker_{}.csv".format(dataset, proj_name)
-    tracker_df = pd.read_csv(data_tracker_file)
+    tracker_df = tracker_model.read_tracker(data_tracker_file)
 
-    tracker_ids = tracker_df["id"].tolist()
+    tracker_ids = tracker_df.index.tolist()
     new_subjects = list(set(ids).difference(tracker_ids))
     if len(new_subjects) > 0:
-        new_subjects_df = pd.DataFrame({"id": new_subjects})
-        tracker_df = tracker_df.append(new_subjects_df)
-    tracker_df = tracker_df.set_index("id")
+        tracker_df = tracker_model.add_subjects(tracker_df, new_subjects)
     tracker_df.sort_index(axis="index", inplace=True)
 
     subjects = tracker_df.index.to_list()
 
-    all_redcap_columns = dict() # list of all redcap columns whose names should be mirrored in central tracker
+    # only rows whose REDCap records or checked/ folders changed since the last run are recomputed
+    manifest_file = tracker_manifest.manifest_path(dataset, session)
+    previous = None if full else tracker_manifest.load_manifest(manifest_file, plan.digest, checked_path, child)
+    manifest = tracker_manifest.new_manifest(plan.digest, checked_path, child)
+    dirty = None if previous is None else set(subjects).difference(previous["subjects"])
+
+    all_redcap_columns = dict() # redcap column -> redcaps that have it, see index_columns
     all_redcap_paths = dict()
     
     if redcaps[0] != "none":
         all_rc_dfs = dict()
+        all_rc_headers = dict()
         all_rc_subjects = dict()
+        rc_problems = []
         for expected_rc in redcheck_columns.keys():
             present = False
             for redcap in redcaps:
@@ -269,98 +278,78 @@ if __name__ == "__main__":
                     sys.exit(c.RED + "Error: multiple redcaps found with name specified in datadict, " + redcap_path + " and " + redcap + ", exiting." + c.ENDC)
             if present == False:
                 sys.exit(c.RED + "Error: can't find redcap specified in datadict " + expected_rc + ", exiting." + c.ENDC)
+            # id and duplicate columns come from the header, then only the columns the datadict maps are loaded
+            header = redcap_loader.read_header(redcap_path)
+            all_rc_headers[expected_rc] = header
             if "id_column" in redcheck_columns[expected_rc].keys():
-                id_col = redcheck_columns[expected_rc]["id_column"]
-                for column in pd.read_csv(redcap_path).columns:
-                    if column.startswith(id_col):
-                        all_rc_dfs[expected_rc] = pd.read_csv(redcap_path, index_col = column)
+                id_col = redcap_loader.id_column(redcap_path, redcheck_columns[expected_rc]["id_column"])
+                if id_col is None:
+                    sys.exit(c.RED + "Error: can't find id column " + redcheck_columns[expected_rc]["id_column"] + " in redcap " + redcap_path + ", exiting." + c.ENDC)
             else:
                 id_col = "record_id"
-                all_rc_dfs[expected_rc] = pd.read_csv(redcap_path, index_col = id_col)
             # If hallMonitor passes "redcap" arg, data exists and passed checks 
-            vals = pd.read_csv(redcap_path, header=None, nrows=1).iloc[0,:].value_counts()
             # Exit if duplicate column names in redcap
-            if any(vals.values != 1):
-                dupes = []
-                for rc_col in vals.keys():
-                    if vals[rc_col] > 1:
-                        dupes.append(rc_col)
-                sys.exit(c.RED + 'Error: Duplicate columns found in redcap ' + redcap_path + ': ' + ', '.join(dupes) + '. Exiting' + c.ENDC)
+            dupes = redcap_loader.duplicate_columns(redcap_path)
+            if len(dupes) > 0:
+                rc_problems.append('Duplicate columns found in redcap ' + redcap_path + ': ' + ', '.join(dupes))
+                continue
+            rc_columns = [id_col] + [key for key in redcheck_columns[expected_rc].keys() if key != "id_column"]
+            rc_columns += parent_rc_columns(plan, expected_rc, header)
+            all_rc_dfs[expected_rc] = redcap_loader.read_redcap(redcap_path, rc_columns).set_index(id_col)
+        # check every export's columns up front and report all problems at once, before the tracker is touched
+        all_redcap_columns = index_columns(all_rc_headers)
+        rc_problems += redcap_column_problems(redcheck_columns, allowed_duplicate_columns, all_redcap_columns)
+        if len(rc_problems) > 0:
+            sys.exit(c.RED + "Error: problems found in redcap columns, exiting.\n  " + "\n  ".join(rc_problems) + c.ENDC)
+        record_ids = dict()
+        completed_ids = dict() # tracker column -> subjects set to 1 from a redcap during this run
+        for expected_rc in redcheck_columns.keys():
+            rc_df = all_rc_dfs[expected_rc]
+            record_ids[expected_rc] = map_record_ids(rc_df)
+            rc_index, tracker_ids = record_ids[expected_rc][0], record_ids[expected_rc][3]
+            # missing subjects are found from the raw IDs, so key records by those as well
+            subject_ids = [tracker_ids, get_child_ids(rc_index)]
+            manifest["redcaps"][expected_rc] = {"columns": [str(rc_df.index.name)] + list(rc_df.columns),
+                                                "records": tracker_manifest.record_hashes(rc_df, subject_ids)}
+            if dirty is not None:
+                old_rc = previous["redcaps"].get(expected_rc)
+                if old_rc is None or old_rc["columns"] != manifest["redcaps"][expected_rc]["columns"]:
+                    dirty = None
+                else:
+                    changed = tracker_manifest.changed_keys(old_rc["records"], manifest["redcaps"][expected_rc]["records"])
+                    dirty.update(int(subj) for subj in changed)
+
         for expected_rc in redcheck_columns.keys():
             rc_df = all_rc_dfs[expected_rc]
             rc_subjects = []
             rc_ids = rc_df.index.tolist()
             if child == 'true':
-                for id in rc_ids:
-                    if re.search(study_no + '[089](\d{4})', str(id)):
-                        child_id = int(study_no + '0' + re.search(study_no + '[089](\d{4})', str(id)).group(1))
-                        rc_subjects.append(child_id)
+                rc_subjects = get_child_ids(rc_ids).dropna().tolist()
             else:
                 rc_subjects = rc_ids
             rc_subjects.sort()
 
             all_rc_subjects[expected_rc] = rc_subjects
 
-            all_keys = dict()
-            for key, value in redcheck_columns[expected_rc].items():
-                all_keys[key] = value
-                if key.startswith("consent") or key.startswith("assent") or key.startswith("id_column"):
-                #if key.startswith("consent") or key.startswith("assent") or key.startswith("id_column") or key.startswith("demo_e"):
-                    continue
-                if not re.match('^.*es(_[a-zA-Z])?_s[0-9]+_r[0-9]+_e[0-9]+_complete', key) and key not in all_rc_dfs[expected_rc].columns:
-                    other_rcs = []
-                    other_rc_dfs = {rc: all_rc_dfs[rc] for rc in all_rc_dfs if rc != expected_rc}
-                    for redcap, other_rc_df in other_rc_dfs.items():
-                        if key in other_rc_df.columns:
-                            other_rcs.append(redcap)
-                    if len(other_rcs) >= 1:
-                        sys.exit(c.RED + "Error: can\'t find " + key + " in " + expected_rc + " redcap, but found in " + ", ".join(other_rcs) + " redcaps, exiting." + c.ENDC)
-                    else:
-                        sys.exit(c.RED + "Error: can\'t find " + key + " in " + expected_rc + " redcap, exiting." + c.ENDC)
-
-            for index, row in rc_df.iterrows():
-                if (isinstance(index, float) or isinstance(index, int)) and not math.isnan(index):
-                    id = int(row.name)
+            all_keys = dict(redcheck_columns[expected_rc])
+            rc_index, valid, ids, tracker_ids = record_ids[expected_rc]
+            matched = tracker_ids.notna()
+            in_tracker = matched & tracker_ids.isin(tracker_df.index)
+            for pos in (~in_tracker).to_numpy().nonzero()[0]:
+                if not valid[pos]:
+                    print("skipping nan value in ", str(all_redcap_paths[expected_rc]), ": ", str(rc_index[pos]))
+                elif not matched[pos]:
+                    print(str(ids[pos]), "doesn't match expected child or parent id format of \"" + study_no +"{0,8, or 9}XXXX\", skipping")
                 else:
-                    print("skipping nan value in ", str(all_redcap_paths[expected_rc]), ": ", str(index))
-                    continue
-                if child == 'true':
-                    if re.search(study_no + '[089](\d{4})', str(id)):
-                        child_id = study_no + '0' + re.search(study_no + '[089](\d{4})', str(id)).group(1)
-                        child_id = int(child_id)
-                    else:
-                        print(str(id), "doesn't match expected child or parent id format of \"" + study_no +"{0,8, or 9}XXXX\", skipping")
-                        continue
-                else:
-                    child_id = id
-                if child_id not in tracker_df.index:
-                    print(child_id, "missing in tracker file, skipping")
-                    continue
-
-                keys_in_redcap = dict()
-                for key, value in all_keys.items():
-                    try:
-                        val = rc_df.loc[id, key]
-                        keys_in_redcap[key] = value
-                        try:
-                            if tracker_df.loc[child_id, value] == "1":
-                                # if value already set continue
-                                continue
-                            else:
-                                tracker_df.loc[child_id, value] = "1" if val == 2 else "0"
-                        except:
-                            tracker_df.loc[child_id, value] = "1" if val == 2 else "0"
-                    except Exception as e_msg:
-                        continue
-
-            # for subject IDs missing from redcap, fill in "0" in redcap columns
-            for subj in set(subjects).difference(rc_subjects):
-                for key, value in keys_in_redcap.items():
-                    if re.match('^.*' + session + '_e[0-9]+$', value):
-                        try:
-                            tracker_df.loc[subj, value] = "0"
-                        except Exception as e_msg:
-                            continue
+                    print(tracker_ids[pos], "missing in tracker file, skipping")
+
+            keys_in_redcap = update_redcap_columns(tracker_df, rc_df, all_keys, tracker_ids, in_tracker, completed_ids, dirty)
+
+            # for subject IDs missing from redcap, fill in 0 in redcap columns
+            missing_subjects = sorted(set(subjects).difference(rc_subjects))
+            for key, value in keys_in_redcap.items():
+                if re.match('^.*' + session + '_e[0-9]+$', value) and len(missing_subjects) > 0:
+                    tracker_model.set_cells(tracker_df, value, missing_subjects, 0, text=True)
 
             duplicate_cols = []
             # drop any duplicate columns ending in ".NUMBER"
@@ -368,96 +357,63 @@ if __name__ == "__main__":
                 if re.match('^.*\.[0-9]+$', col):
                     duplicate_cols.append(col)
             tracker_df.drop(columns=duplicate_cols, inplace=True)
-            tracker_df.to_csv(data_tracker_file)
-
-            for col in rc_df.columns:
-                if col.endswith(completed):
-                    all_redcap_columns.setdefault(col,[]).append(all_redcap_paths[expected_rc])
 
-        parent_info = parent_columns(df_dd)
+        parent_info = parent_columns(plan)
 
         for expected_rc in redcheck_columns.keys():
             if expected_rc in parent_info.keys():
-                for subj in set(subjects).difference(all_rc_subjects[expected_rc]):
-                    for col in tracker_df.columns:
-                        for var in parent_info[expected_rc]:
-                            if re.match('^' + var + '_' + session + '_e[0-9]+$', col):
-                                try:
-                                    tracker_df.loc[subj, col] = "NA"
-                                except Exception as e_msg:
-                                    continue
-
-        all_duplicate_cols = []
-        redcaps_of_duplicates = []
-        for col, rcs in all_redcap_columns.items():
-            if len(all_redcap_columns[col]) > 1 and col not in allowed_duplicate_columns:
-                all_duplicate_cols.append(col)
-                redcaps_of_duplicates.append(', '.join(rcs))
-        if len(all_duplicate_cols) > 0:
-            errmsg = c.RED + "Error: Duplicate columns were found across Redcaps: "
-            for i in range(0, len(all_duplicate_cols)):
-                errmsg = errmsg + all_duplicate_cols[i] + " in " + redcaps_of_duplicates[i] + "; "
-            sys.exit(errmsg + "Exiting." + c.ENDC)
+                missing_subjects = sorted(set(subjects).difference(all_rc_subjects[expected_rc]))
+                for col in tracker_df.columns:
+                    for var in parent_info[expected_rc]:
+                        if re.match('^' + var + '_' + session + '_e[0-9]+$', col) and len(missing_subjects) > 0:
+                            tracker_model.set_cells(tracker_df, col, missing_subjects, "NA", text=True)
     else:
         sys.exit('Can\'t find redcaps in ' + dataset + '/sourcedata/raw/redcap, skipping ')
 
-    for task, values in tasks_dict.items():
-        datatype = values[0]
-        file_exts = values[1].split(", ")
-        file_sfxs = values[2].split(", ")
+    # one scandir pass over checked/, then every task/suffix is a dictionary lookup; folders
+    # unchanged since the last run are not listed again
+    known = None
+    if previous is not None:
+        known = dict()
+        for key, (mtime, size, names) in previous["dirs"].items():
+            sub, datatype = key.split("/", 1)
+            known[(int(sub), session, datatype)] = ((mtime, size), names)
+    inventory = file_inventory.scan_checked(checked_path, session, known)
+    manifest["dirs"] = {tracker_manifest.dir_key(sub, datatype): list(folder.signature) + [folder.names]
+                        for (sub, _, datatype), folder in inventory.items()}
+    presence = dict()
+    for task, spec in tasks_dict.items():
+        datatype = spec.datatype
+        file_exts = spec.exts
+        file_sfxs = spec.suffixes
         for subj in subjects:
-            no_data = False
-            subdir = "sub-" + str(subj)
             dir_id = int(subj)
+            folder = inventory.get((dir_id, session, datatype))
             for sfx in file_sfxs:
                 suf_re = re.match('^(s[0-9]+_r[0-9]+)_e[0-9]+$', sfx)
                 if suf_re and suf_re.group(1) == session:
-                    try:
-                        corrected = False
-                        for filename in listdir(join(checked_path, subdir, session, datatype)):
-                            if re.match('^[Dd]eviation.*$', filename):
-                                corrected = True
-                                break
-                            if re.match('^no-data\.txt$', filename):
-                                tracker_df.loc[dir_id, task + "_" + sfx] = "0"
-                                no_data = True
-                                break
-                        if no_data:
-                            break
-                        all_files_present = True
-                        for ext in file_exts:
-                            file_present = False
-                            for filename in listdir(join(checked_path, subdir, session, datatype)):
-                                if corrected:
-                                    if re.match('^sub-' + str(dir_id) + '_' + task + '_' + sfx + '[a-zA-Z0-9_-]*\\' + ext + '$', filename):
-                                    # when deviation.txt file present allow string between suffix and ext (e.g. "s1_r1_e1_firstrun_practice.eeg")
-                                        file_present = True
-                                        break
-                                else:
-                                    if re.match('^sub-' + str(dir_id) + '_' + task + '_' + sfx + '\\' + ext + '$', filename):
-                                        file_present = True
-                                        break
-                            if not file_present:
-                                all_files_present = False
-                        if all_files_present:
-                            tracker_df.loc[dir_id, task + "_" + sfx] = "1"
-                        else:
-                            tracker_df.loc[dir_id, task + "_" + sfx] = "0"
-                    except:
-                        tracker_df.loc[dir_id, task + "_" + sfx] = "0"
-
-    fill_combination_columns(tracker_df, df_dd)
-
-    tracker_df.to_csv(data_tracker_file)
-
-    # Create more readable csv with no blank columns
-    tracker_df = pd.read_csv(data_tracker_file, index_col="id")
-    data_tracker_filename = splitext(data_tracker_file)[0]
-    tracker_df_no_blank_columns = tracker_df.loc[:, tracker_df.notnull().any(axis=0)]
-    tracker_df_no_blank_columns = tracker_df_no_blank_columns.fillna("NA")
-    tracker_df_no_blank_columns.to_csv(data_tracker_filename + "_viewable.csv")
+                    col = presence.setdefault(task + "_" + sfx, dict())
+                    if folder is None:
+                        col[dir_id] = 0
+                    elif folder.no_data:
+                        col[dir_id] = 0
+                        break
+                    elif all(folder.has_file(dir_id, task, sfx, ext) for ext in file_exts):
+                        col[dir_id] = 1
+                    else:
+                        col[dir_id] = 0
+    for col, values in presence.items():
+        tracker_model.set_cells(tracker_df, col, list(values.keys()), list(values.values()), text=True)
+
+    fill_combination_columns(tracker_df, plan)
+
+    # tracker and more readable csv with no blank columns, written once at the end
+    tracker_model.write_outputs(tracker_df, data_tracker_file)
+
+    manifest["subjects"] = [int(subj) for subj in tracker_df.index if not pd.isna(subj)]
+    tracker_manifest.save_manifest(manifest_file, manifest)
 
             # make remaining empty values equal to 0
             # tracker_df[collabel] = tracker_df[collabel].fillna("0")
 
-    print(c.GREEN + "Success: {} data tracker updated.".format(', '.join([dtype[0] for dtype in list(tasks_dict.values())])) + c.ENDC)
+    print(c.GREEN + "Success: {} data tracker updated.".format(', '.join([spec.datatype for spec in tasks_dict.values()])) + c.ENDC)
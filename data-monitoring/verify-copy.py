@@ -1,15 +1,23 @@
 #!/usr/bin/env python3
 
 import sys
-from os import listdir, makedirs, system
-from os.path import join, isdir, isfile, splitext, getsize, basename
+from os.path import join, isdir, isfile, splitext, basename
 
 import shutil
-import pandas as pd
 import re
 import math
 from collections import defaultdict
 import importlib
+import io
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import brainvision
+import copy_engine
+import datadict_plan
+import file_checksums
+import file_inventory
 
 class c:
     RED = '\033[31m'
@@ -18,23 +26,45 @@ class c:
     BOLD = '\033[1m'
     UNDERLINE = '\033[4m'
 
-def allowed_val(allowed_vals, value):
-    allowed_vals = allowed_vals.replace(" ", "")
-    intervals = re.split("[\[\]]", allowed_vals)
-    intervals = list(filter(lambda x: x not in [",", ""], intervals))
-    allowed = False
-    for interval in intervals:
-        lower = float(interval.split(",")[0])
-        upper = float(interval.split(",")[1])
-        if lower <= int(value) <= upper:
-            allowed = True
-            break
-    return allowed
+def captured(func, *args):
+    # what func(*args) prints, run inside a --jobs worker
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        func(*args)
+    return out.getvalue()
+
+def start_pool():
+    # workers are forked so they share the datadict plan and tree snapshot already loaded
+    global pool
+    pool = None
+    if jobs > 1 and "fork" in multiprocessing.get_all_start_methods():
+        pool = ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context("fork"))
+
+def validate(func, *args):
+    # run one subject folder check now, or queue it on the --jobs pool
+    if pool is None:
+        func(*args)
+    else:
+        pending.append(pool.submit(captured, func, *args))
 
-def check_number_of_files(path, datatype, tasks, corrected):
+def report(*args):
+    # print, kept in order with the output of queued checks
+    if pool is None:
+        print(*args)
+    else:
+        pending.append(" ".join(str(arg) for arg in args) + "\n")
+
+def flush():
+    # print everything queued in the order it was queued, so the log matches a serial run
+    for item in pending:
+        sys.stdout.write(item if isinstance(item, str) else item.result())
+    del pending[:]
+    sys.stdout.flush()
+
+def check_number_of_files(path, datatype, tasks, corrected, sub):
     if corrected:
         return
-    for raw_file in listdir(path):
+    for raw_file in tree.listdir(path):
         file_re = re.match('^sub-([0-9]{7})_(.*)_(s[0-9]+_r[0-9]+_e[0-9]+)\.([a-z0-9.]+)$', raw_file)
         if re.match('^[Dd]eviation$', raw_file):
             return
@@ -55,18 +85,18 @@ def check_number_of_files(path, datatype, tasks, corrected):
             if task in combination_rows[row] and row not in already_counted:
                 comb = True
                 already_counted.extend(combination_rows[row])
-                taskssum += len(dd_dict[task][2].split(",")) # number files expected from expectedFileExt # assume combination rows expect same # files
+                taskssum += len(dd_dict[task].exts) # number files expected from expectedFileExt # assume combination rows expect same # files
                 break
         if not comb:
             # not a combination row
-            taskssum += len(dd_dict[task][2].split(",")) # number files expected from expectedFileExt
-    obs_files = len(listdir(path))
+            taskssum += len(dd_dict[task].exts) # number files expected from expectedFileExt
+    obs_files = len(tree.listdir(path))
     if obs_files > taskssum:
         print(c.RED + "Error: number of", datatype, "data files in subject folder", sub, str(obs_files), "greater than the expected number", str(taskssum) + c.ENDC)
     if obs_files < taskssum:
         print(c.RED + "Error: number of", datatype, "data files in subject folder", sub, str(obs_files), "less than the expected number", str(taskssum) + c.ENDC)
     tasks_seen = []
-    for raw_file in listdir(path):
+    for raw_file in tree.listdir(path):
         file_re = re.match('^sub-([0-9]+)_(.*)_(s[0-9]+_r[0-9]+_e[0-9]+)\.([a-z0-9]+)$', raw_file)
         if file_re and file_re.group(2) not in tasks_seen:
             tasks_seen.append(file_re.group(2))
@@ -76,50 +106,51 @@ def check_number_of_files(path, datatype, tasks, corrected):
             print(c.RED + "Error: multiple different combination rows", str(combination_rows_seen), "seen in subject folder", sub, ": ", str(path), ", only one expected." + c.ENDC)
 
 def check_filenames(path, sub, ses, datatype, allowed_suffixes, possible_exts, corrected):
-        task_files_counter = defaultdict(lambda: 0)
-        task_names = []
-        for raw_file in listdir(path):
-            for task in task_vars:
-                if re.match('^sub-([0-9]{7})_('+task +')_(s[0-9]+_r[0-9]+_e[0-9]+)\.([a-z0-9.]+)$', raw_file):
-                    if task not in task_names:
-                        task_names.append(task)
-                    task_files_counter[task] += 1
-        for raw_file in listdir(path):
+        # every file is parsed once by the naming convention grammar, its fields are then set/dict lookups
+        allowed_suffixes_set = set(allowed_suffixes)
+        possible_exts_set = set(possible_exts)
+        # subject numbers of the whole folder checked against the allowed IDs at once
+        folder = {raw_file: file_inventory.parse_convention(raw_file) for raw_file in tree.listdir(path)}
+        subs = sorted({parsed.sub for parsed in folder.values() if parsed and parsed.sub != ''})
+        allowed_ids = dict(zip(subs, plan.allowed_ids.allowed_many(subs)))
+        # the folder's psychopy CSVs go to check-id in one batch, each result is printed in place below
+        id_pairs = [(parsed.sub, join(path, raw_file)) for raw_file, parsed in folder.items()
+                    if datatype == "psychopy" and parsed and parsed.ext == ".csv" and parsed.sub != "" and tree.getsize(join(path, raw_file)) != 0]
+        id_mismatches = {mismatch.file: mismatch for mismatch in check_id.check_ids(id_pairs)}
+        for raw_file, parsed in folder.items():
             #check sub-#, check session folder, check extension
-            if getsize(join(path, raw_file)) == 0 and not re.match('deviation\.txt', raw_file):
+            if tree.getsize(join(path, raw_file)) == 0 and not re.match('deviation\.txt', raw_file):
                 print(c.RED + "Error: empty file", join(path, raw_file), "seen, please notify EEG RAs that an empty file was uploaded and upload correct file." + c.ENDC)
                 continue
-            file_re = re.match("^(sub-([0-9]*))_([a-zA-Z0-9_-]*)_((s([0-9]*)_r([0-9]*))_e([0-9]*))(_[a-zA-Z0-9_-]+)?((?:\.[a-zA-Z]+)*)$", raw_file)
-            if file_re:
-                if file_re.group(1) != sub:
-                    print(c.RED + "Error: file from subject", file_re.group(1), "found in", sub, "folder:", join(path, raw_file) + c.ENDC)
-                if file_re.group(5) != ses and len(ses) > 0:
-                    print(c.RED + "Error: file from session", file_re.group(5), "found in", ses, "folder:", join(path, raw_file) + c.ENDC)
-                if file_re.group(10) not in possible_exts and len(file_re.group(10)) > 0:
-                    print(c.RED + "Error: file with extension", file_re.group(10), "found, doesn\'t match expected extensions", ", ".join(possible_exts), ":", join(path, raw_file) + c.ENDC)
-                if file_re.group(2) != '' and not allowed_val(allowed_subs, file_re.group(2)):
-                    print(c.RED + "Error: subject number", file_re.group(2), "not an allowed subject value", allowed_subs, "in file:", join(path, raw_file) + c.ENDC)
-                if file_re.group(3) not in dd_dict.keys():
-                    print(c.RED + "Error: variable name", file_re.group(3), "does not match any datadict variables, in file:", join(path, raw_file) + c.ENDC)
-                if datatype not in file_re.group(3):
-                    print(c.RED + "Error: variable name", file_re.group(3), "does not contain the name of the enclosing datatype folder", datatype, "in file:", join(path, raw_file) + c.ENDC)
-                if file_re.group(4) not in allowed_suffixes:
-                    print(c.RED + "Error: suffix", file_re.group(4), "not in allowed suffixes", ", ".join(allowed_suffixes), "in file:", join(path, raw_file) + c.ENDC)
-                if file_re.group(2) == "":
+            if parsed:
+                if parsed.sub_label != sub:
+                    print(c.RED + "Error: file from subject", parsed.sub_label, "found in", sub, "folder:", join(path, raw_file) + c.ENDC)
+                if parsed.session != ses and len(ses) > 0:
+                    print(c.RED + "Error: file from session", parsed.session, "found in", ses, "folder:", join(path, raw_file) + c.ENDC)
+                if parsed.ext not in possible_exts_set and len(parsed.ext) > 0:
+                    print(c.RED + "Error: file with extension", parsed.ext, "found, doesn\'t match expected extensions", ", ".join(possible_exts), ":", join(path, raw_file) + c.ENDC)
+                if parsed.sub != '' and not allowed_ids[parsed.sub]:
+                    print(c.RED + "Error: subject number", parsed.sub, "not an allowed subject value", allowed_subs, "in file:", join(path, raw_file) + c.ENDC)
+                if parsed.task not in dd_dict:
+                    print(c.RED + "Error: variable name", parsed.task, "does not match any datadict variables, in file:", join(path, raw_file) + c.ENDC)
+                if datatype not in parsed.task:
+                    print(c.RED + "Error: variable name", parsed.task, "does not contain the name of the enclosing datatype folder", datatype, "in file:", join(path, raw_file) + c.ENDC)
+                if parsed.suffix not in allowed_suffixes_set:
+                    print(c.RED + "Error: suffix", parsed.suffix, "not in allowed suffixes", ", ".join(allowed_suffixes), "in file:", join(path, raw_file) + c.ENDC)
+                if parsed.sub == "":
                     print(c.RED + "Error: subject # missing from file:", join(path, raw_file) + c.ENDC)
-                if file_re.group(3) == "":
+                if parsed.task == "":
                     print(c.RED + "Error: variable name missing from file:", join(path, raw_file) + c.ENDC)
-                if file_re.group(6) == "":
+                if parsed.ses_no == "":
                     print(c.RED + "Error: session # missing from file:", join(path, raw_file) + c.ENDC)
-                if file_re.group(7) == "":
+                if parsed.run_no == "":
                     print(c.RED + "Error: run # missing from file:", join(path, raw_file) + c.ENDC)
-                if file_re.group(8) == "":
+                if parsed.event_no == "":
                     print(c.RED + "Error: event # missing from file:", join(path, raw_file) + c.ENDC)
-                if file_re.group(10) == "":
+                if parsed.ext == "":
                     print(c.RED + "Error: extension missing from file, does\'nt match expected extensions", ", ".join(possible_exts), ":", join(path, raw_file) + c.ENDC)
-                if datatype == "psychopy" and file_re.group(10) == ".csv" and file_re.group(2) != "":
-                    # Call check-id.py for psychopy files
-                    check_id.check_id(file_re.group(2), join(path, raw_file))
+                if join(path, raw_file) in id_mismatches:
+                    print(check_id.message(id_mismatches[join(path, raw_file)]))
             else:
                 if not re.match('[Dd]eviation\.txt', raw_file):
                     print(c.RED + "Error: file ", join(path, raw_file), " does not match naming convention <sub-#>_<variable/task-name>_<session>.<ext>" + c.ENDC)
@@ -131,105 +162,115 @@ def check_for_files(path, sub, allowed_suffixes, possible_exts, var):
             combination = True
             combination_var = dict_var
             break
+    variables = combination_rows[combination_var] if combination else [var]
+    # (variable, suffix, extension) of every <sub>_<var>_<suffix>[_<anything>]<ext> file in the folder
+    present = set()
+    for rawfile, parsed in tree.inventory(path).parsed.items():
+        if rawfile.startswith(sub + "_") and (parsed.extra == "" or parsed.extra.startswith("_")):
+            present.add((parsed.task, parsed.suffix, parsed.ext))
     for ext in possible_exts:
         file_present = False
         for ext2 in ext.split("|"): # in case of multiple options for extensions i.e. .zip.gpg|.tar.gpg
             for suf in allowed_suffixes:
-                if combination:
-                    for eitheror_var in combination_rows[combination_var]:
-                        for rawfile in listdir(path):
-                            if re.match('^'+sub+'_'+eitheror_var+'_'+suf+'(_[a-zA-Z0-9_-]+)?'+ext2+'$', rawfile):
-                                file_present = True
-                                break
-                else:
-                    for rawfile in listdir(path):
-                        if re.match('^'+sub+'_'+var+'_'+suf+'(_[a-zA-Z0-9_-]+)?'+ext2+'$', rawfile):
-                            file_present = True
-                            break
+                for eitheror_var in variables:
+                    if (eitheror_var, suf, ext2) in present:
+                        file_present = True
+                        break
         if not file_present:
                 print(c.RED + "Error: no such file", sub+'_'+var+'_sX_rX_eX'+ext, "can be found in", path + c.ENDC)
 
-def check_eeg_metadata(sub_path, eeg_path):
+def check_eeg_metadata(sub_path, eeg_path, scan_signals=False):
     # Check that DataFile and MarkerFile match up with filename in both .vmrk and .vhdr files
-    for sub in listdir(sub_path):
+    for sub in tree.listdir(sub_path):
         path = join(sub_path, sub, eeg_path)
-        if isdir(path):
-            for file in listdir(path):
-                vhdr_fname = splitext(file)[0]
-                if file.endswith('.vhdr'):
-                    with open(join(sub_path, sub, eeg_path, file)) as f:
-                        for i, line in enumerate(f):
-                            if i == 5: # Should be "DataFile" line
-                                fname = line.split('=')[1].strip('\n')
-                            if i == 6: # "MarkerFile"
-                                vmrk = line.split('=')[1].strip('\n')
-                                break
-                    f.close()
-                    eeg_fname = splitext(fname)[0]
-                    vmrk_fname = splitext(vmrk)[0]
-                    if vhdr_fname != eeg_fname:
-                        print(c.RED + "Error: DataFile in header " + fname + " does not match up with name of file " + file + " in folder " + path + "." + c.ENDC)
-                    if vhdr_fname != vmrk_fname:
-                        print(c.RED + "Error: MarkerFile in header " + vmrk + " does not match up with name of file " + file + " in folder " + path + "." + c.ENDC)
-                elif file.endswith('.vmrk'):
-                    with open(join(sub_path, sub, eeg_path, file)) as f:
-                        for i, line in enumerate(f):
-                            if i == 4: # "DataFile"
-                                fname = line.split('=')[1].strip('\n')
-                                break
-                    f.close()
-                    eeg_fname = splitext(fname)[0]
-                    if vhdr_fname != eeg_fname:
-                        print(c.RED + "Error: DataFile in header " + fname + " does not match up with name of file " + file + " in folder " + path + "." + c.ENDC)
+        if tree.isdir(path):
+            # headers are read (or taken from the cache) here so the cache outlives --jobs workers
+            headers = {file: eeg_headers.header(join(path, file)) for file in tree.listdir(path) if file.endswith(('.vhdr', '.vmrk'))}
+            signals = dict()
+            if scan_signals:
+                # .eeg files whose size fits their header are scanned for flat, saturated or dropped-out signal
+                eeg_files = [(join(path, header.data_file), header) for file, header in headers.items()
+                             if file.endswith('.vhdr') and header.data_file is not None and tree.isfile(join(path, header.data_file))]
+                eeg_files = [(eeg_file, header) for eeg_file, header in eeg_files
+                             if brainvision.binary_layout(header) is not None and brainvision.size_problem(header, tree.getsize(eeg_file)) is None]
+                signals = eeg_signals.summaries(eeg_files)
+            validate(check_eeg_headers, path, headers, signals)
+
+def check_eeg_headers(path, headers, signals):
+    for file, header in headers.items():
+        vhdr_fname = splitext(file)[0]
+        fname = header.data_file
+        if fname is None:
+            print(c.RED + "Error: no DataFile in header of file " + file + " in folder " + path + "." + c.ENDC)
+            continue
+        eeg_fname = splitext(fname)[0]
+        if vhdr_fname != eeg_fname:
+            print(c.RED + "Error: DataFile in header " + fname + " does not match up with name of file " + file + " in folder " + path + "." + c.ENDC)
+        if file.endswith('.vhdr'):
+            vmrk = header.marker_file
+            if vmrk is None:
+                print(c.RED + "Error: no MarkerFile in header of file " + file + " in folder " + path + "." + c.ENDC)
+            elif vhdr_fname != splitext(vmrk)[0]:
+                print(c.RED + "Error: MarkerFile in header " + vmrk + " does not match up with name of file " + file + " in folder " + path + "." + c.ENDC)
+            # a truncated upload leaves a partial sample at the end of the .eeg
+            if tree.isfile(join(path, fname)):
+                problem = brainvision.size_problem(header, tree.getsize(join(path, fname)))
+                if problem is not None:
+                    print(c.RED + "Error: " + fname + " in folder " + path + " does not match its header " + file + ": " + problem + ", the upload may be truncated." + c.ENDC)
+            summary = signals.get(join(path, fname))
+            if summary is not None and summary.problems != "":
+                print(c.RED + "Error: " + fname + " in folder " + path + " does not look like a usable recording: " + summary.problems + "." + c.ENDC)
 
 if __name__ == "__main__":
     dataset = sys.argv[1]
+    # --jobs N checks subject folders on N processes, output still comes out in serial order
+    jobs = int(sys.argv[sys.argv.index("--jobs") + 1]) if "--jobs" in sys.argv[2:] else 1
+    pool = None
+    pending = []
 
     raw = join(dataset,"sourcedata","raw")
     checked = join(dataset,"sourcedata","checked")
 
+    # raw is listed once here and checked once its copies are done, every check below reads the snapshot
+    tree = file_inventory.TreeSnapshot()
+    tree.scan(raw)
+    start_pool()
+
     datadict = "{}/data-monitoring/data-dictionary/central-tracker_datadict.csv".format(dataset)
 
     sessions = False
-    for dir in listdir(join(dataset,"sourcedata","raw")):
+    for dir in tree.listdir(raw):
         if re.match("s[0-9]+_r[0-9]+(_e[0-9]+)?", dir):
             sessions = True
             break
 
     check_id = importlib.import_module("check-id")
 
-    df_dd = pd.read_csv(datadict, index_col = "variable")
-    dd_dict = dict()
-
-    task_vars = []
-    combination_rows = {}
-    for _, row in df_dd.iterrows():
-        if not isinstance(row["expectedFileExt"], float):
-            task_vars.append(row.name)
-        if row["dataType"] == "combination":
-            idx = row["provenance"].split(" ").index("variables:")
-            vars = "".join(row["provenance"].split(" ")[idx+1:]).split(",")
-            vars = [var.strip("\"") for var in vars]
-            combination_rows[row.name] = vars
+    # expected files/datatypes from datadict
+    plan = datadict_plan.load_plan(datadict)
+    dd_dict = plan.tasks
+    task_vars = list(plan.tasks.keys())
+    combination_rows = {var: comb.variables for var, comb in plan.combinations.items()}
 
-    # build dict of expected files/datatypes from datadict
-    for var, row in df_dd.iterrows():
-        if row.name in task_vars:
-            dd_dict[var] = [row["dataType"], row["allowedSuffix"], row["expectedFileExt"], row["allowedValues"]]
+    allowed_subs = plan.id_allowed_values
 
-    allowed_subs = df_dd.loc["id", "allowedValues"]
+    copier = copy_engine.CopyEngine()
+    eeg_headers = brainvision.HeaderCache(datadict_plan.default_cache_dir(datadict))
+    eeg_signals = brainvision.SignalRecord(dataset)
+    checksums = file_checksums.ChecksumRecord(dataset)
+    copied_files = [] # (raw, checked) pairs copied this run
+    existing_files = [] # (raw, checked) pairs already in checked, compared by hash below
 
     # now search sourcedata/raw for correct files
     dtypes = []
     dtype_exts = defaultdict(lambda: [])
     dtype_sfxs = defaultdict(lambda: [])
     for variable, values in dd_dict.items():
-        print("Verifying files in raw for:", variable)
+        report("Verifying files in raw for:", variable)
         variable = variable
-        datatype = values[0]
-        allowed_suffixes = values[1].split(", ")
-        fileexts = values[2].split(", ") # with or without . ?
-        allowed_vals = values[3].split(", ")
+        datatype = values.datatype
+        allowed_suffixes = values.suffixes
+        fileexts = values.exts # with or without . ?
         possible_exts = sum([ext.split('|') for ext in fileexts], []) #shouldn't this be done later?
         numfiles = len(fileexts)
 
@@ -247,52 +288,76 @@ if __name__ == "__main__":
         else:
             expected_sessions = [""]
         for ses in expected_sessions:
-            if isdir(join(raw, ses, datatype)):
+            if tree.isdir(join(raw, ses, datatype)):
                 # for EEG check that filename in vhdr matches up w/ .eeg file
                 if '.eeg' in possible_exts and '.vmrk' in possible_exts and '.vhdr' in possible_exts:
                     path = join(raw, ses, datatype)
-                    check_eeg_metadata(path, "")
-                for subject in listdir(join(raw, ses, datatype)):
+                    check_eeg_metadata(path, "", scan_signals=True)
+                for subject in tree.listdir(join(raw, ses, datatype)):
                     if not re.match("^sub-[0-9]+$", subject):
-                        print(c.RED + "Error: subject directory ", subject, " does not match sub-# convention" + c.ENDC)
+                        report(c.RED + "Error: subject directory ", subject, " does not match sub-# convention" + c.ENDC)
                         continue
                     path = join(raw, ses, datatype, subject)
                     # check that files in raw match conventions
                     corrected = False
                     no_data = False
-                    for raw_file in listdir(path):
+                    for raw_file in tree.listdir(path):
                         if re.match('^[Dd]eviation.*$', raw_file):
                             corrected = True
-                            system('mkdir -p ' + join(checked, subject, ses, datatype))
-                            system('cp ' + join(raw, ses, datatype, subject, raw_file) + ' ' + join(checked, subject, ses, datatype, raw_file))
+                            copier.copy(join(raw, ses, datatype, subject, raw_file), join(checked, subject, ses, datatype, raw_file), preserve=False)
                         if re.match('^no-data\.txt$', raw_file):
                             no_data = True
-                            system('mkdir -p ' + join(checked, subject, ses, datatype))
-                            system('cp ' + join(raw, ses, datatype, subject, raw_file) + ' ' + join(checked, subject, ses, datatype, raw_file))
+                            copier.copy(join(raw, ses, datatype, subject, raw_file), join(checked, subject, ses, datatype, raw_file), preserve=False)
                     if no_data:
                         continue
-                    check_for_files(path, subject, allowed_suffixes, possible_exts, variable)
+                    validate(check_for_files, path, subject, allowed_suffixes, possible_exts, variable)
                     # copy to checked
                     # copy file to checked, unless "deviation" is seen
                     if corrected:
                         continue
                     for suffix in allowed_suffixes:
                         presence = False
-                        copied_files = []
                         for req_ext in fileexts:
                             for ext in req_ext.split('|'):
-                                for raw_file in listdir(join(raw, ses, datatype, subject)):
+                                for raw_file in tree.listdir(join(raw, ses, datatype, subject)):
                                     if re.match(subject + "_" + variable + "_" + suffix + ext, raw_file):
                                         presence = True
                                         if not isdir(join(checked, subject, ses, datatype)):
-                                            print(c.GREEN + "Creating ", join(subject, ses, datatype), " directory in checked" + c.ENDC)
-                                            makedirs(join(checked, subject, ses, datatype))
-                                        if not isfile(join(checked, subject, ses, datatype, raw_file)) and splitext(raw_file)[1] != '.gpg':
-                                            print(c.GREEN + "Copying ", raw_file, " to checked" + c.ENDC)
-                                            system('cp -p ' + join(raw, ses, datatype, subject, raw_file) + ' ' + join(checked, subject, ses, datatype, raw_file))
-                                        copied_files.append(raw_file)
+                                            report(c.GREEN + "Creating ", join(subject, ses, datatype), " directory in checked" + c.ENDC)
+                                            copier.makedirs(join(checked, subject, ses, datatype))
+                                        if splitext(raw_file)[1] != '.gpg':
+                                            pair = (join(raw, ses, datatype, subject, raw_file), join(checked, subject, ses, datatype, raw_file))
+                                            if not isfile(pair[1]):
+                                                report(c.GREEN + "Copying ", raw_file, " to checked" + c.ENDC)
+                                                copier.copy(*pair)
+                                                copied_files.append(pair)
+                                            else:
+                                                existing_files.append(pair)
             else:
-                print(c.RED + "Error: can\'t find", datatype, "directory under", raw+"/"+ses + c.ENDC)
+                report(c.RED + "Error: can\'t find", datatype, "directory under", raw+"/"+ses + c.ENDC)
+    # files already in checked must match raw, stale or truncated copies are replaced
+    hashes = checksums.hashes([path for pair in existing_files for path in pair])
+    for src, dst in existing_files:
+        if hashes.get(src) != hashes.get(dst):
+            report(c.RED + "Error: " + dst + " does not match " + src + " in raw, copying it again" + c.ENDC)
+            copier.copy(src, dst)
+            copied_files.append((src, dst))
+    # every copy has to be in checked before checked is verified below
+    copier.close()
+    for src, dst, message in copier.errors:
+        report(c.RED + "Error: could not copy " + src + " to " + dst + ": " + message + c.ENDC)
+    hashes = checksums.hashes([path for pair in copied_files for path in pair])
+    for src, dst in copied_files:
+        if dst in hashes and hashes[src] != hashes[dst]:
+            report(c.RED + "Error: copy " + dst + " does not match " + src + " in raw" + c.ENDC)
+    checksums.save()
+    report(copier.summary() + ", " + str(checksums.hashed) + " files hashed, " + str(eeg_signals.scanned) + " EEG recordings scanned")
+    # workers were forked before checked was listed, start new ones that see it
+    flush()
+    tree.scan(checked)
+    if pool is not None:
+        pool.shutdown()
+        start_pool()
     for dtype in dtypes:
         if sessions:
             expected_sessions = []
@@ -303,56 +368,55 @@ if __name__ == "__main__":
         else:
             expected_sessions = [""]
         for ses in expected_sessions:
-            if isdir(join(raw, ses, dtype)):
-                for subject in listdir(join(raw, ses, dtype)):
+            if tree.isdir(join(raw, ses, dtype)):
+                for subject in tree.listdir(join(raw, ses, dtype)):
                     if not re.match("^sub-[0-9]+$", subject):
                         continue
                     path = join(raw, ses, dtype, subject)
                     # check that files in raw match conventions
                     corrected = False
                     no_data = False
-                    for raw_file in listdir(path):
+                    for raw_file in tree.listdir(path):
                         if re.match('^[Dd]eviation.*$', raw_file):
                             corrected = True
                         if re.match('^no-data\.txt$', raw_file):
                             no_data = True
                     if no_data:
                         continue
-                    check_filenames(path, subject, ses, dtype, dtype_sfxs[dtype], dtype_exts[dtype], corrected)
+                    validate(check_filenames, path, subject, ses, dtype, dtype_sfxs[dtype], dtype_exts[dtype], corrected)
 
 
-    print("Verifying numbers of files in subdirectories in raw")
+    report("Verifying numbers of files in subdirectories in raw")
     datatype_folders = []
     for subdir in dd_dict.values():
-        if subdir[0] not in datatype_folders:
-            datatype_folders.append(subdir[0])
-    for session_folder in listdir(raw):
-        if isdir(join(raw, session_folder)):
+        if subdir.datatype not in datatype_folders:
+            datatype_folders.append(subdir.datatype)
+    for session_folder in tree.listdir(raw):
+        if tree.isdir(join(raw, session_folder)):
             for datatype_folder in datatype_folders:
                 tasks = []
                 for task, vals in dd_dict.items():
-                    if vals[0] == datatype_folder:
+                    if vals.datatype == datatype_folder:
                         tasks.append(task)
-                if isdir(join(raw, session_folder, datatype_folder)):
-                    for sub in listdir(join(raw, session_folder, datatype_folder)):
+                if tree.isdir(join(raw, session_folder, datatype_folder)):
+                    for sub in tree.listdir(join(raw, session_folder, datatype_folder)):
                         path = join(raw, session_folder, datatype_folder, sub)
                         corrected = False
-                        for raw_file in listdir(path):
+                        for raw_file in tree.listdir(path):
                             if re.match('^[Dd]eviation.*$', raw_file) or re.match('^no-data\.txt$', raw_file):
                                 corrected = True
                                 break
-                        check_number_of_files(path, datatype_folder, tasks, corrected)
+                        validate(check_number_of_files, path, datatype_folder, tasks, corrected, sub)
     # do same filename checks for checked files
     dtypes = []
     dtype_exts = defaultdict(lambda: [])
     dtype_sfxs = defaultdict(lambda: [])
     for variable, values in dd_dict.items():
-        print("Verifying files in checked for:", variable)
+        report("Verifying files in checked for:", variable)
         variable = variable
-        datatype = values[0]
-        allowed_suffixes = values[1].split(", ")
-        fileexts = values[2].split(", ") # with or without . ?
-        allowed_vals = values[3].split(", ")
+        datatype = values.datatype
+        allowed_suffixes = values.suffixes
+        fileexts = values.exts # with or without . ?
         possible_exts = sum([ext.split('|') for ext in fileexts], [])
         numfiles = len(fileexts)
 
@@ -374,22 +438,22 @@ if __name__ == "__main__":
             for ses in expected_sessions:
                 path = checked
                 check_eeg_metadata(path, join(ses, datatype))
-        for sub in listdir(checked):
+        for sub in tree.listdir(checked):
             if sub.startswith("sub-"):
                 for ses in expected_sessions:
-                    if isdir(join(checked, sub, ses, datatype)):
+                    if tree.isdir(join(checked, sub, ses, datatype)):
                         # check that files in checked match conventions
                         path = join(checked, sub, ses, datatype)
                         corrected = False
                         no_data = False
-                        for raw_file in listdir(path):
+                        for raw_file in tree.listdir(path):
                             if re.match('^[Dd]eviation.*$', raw_file):
                                 corrected = True
                             if re.match('^no-data\.txt$', raw_file):
                                 no_data = True
                         if no_data:
                             break
-                        check_for_files(path, sub, allowed_suffixes, possible_exts, variable)
+                        validate(check_for_files, path, sub, allowed_suffixes, possible_exts, variable)
 
     for dtype in dtypes:
         if sessions:
@@ -400,14 +464,14 @@ if __name__ == "__main__":
                     expected_sessions.append(ses_re.group(1))
         else:
             expected_sessions = [""]
-        for sub in listdir(checked):
+        for sub in tree.listdir(checked):
             if sub.startswith("sub-"):
                 for ses in expected_sessions:
-                    if isdir(join(checked, sub, ses, dtype)):
+                    if tree.isdir(join(checked, sub, ses, dtype)):
                         path = join(checked, sub, ses, dtype)
                         corrected = False
                         no_data = False
-                        for raw_file in listdir(path):
+                        for raw_file in tree.listdir(path):
                             if re.match('^[Dd]eviation.*$', raw_file):
                                 corrected = True
                             if re.match('^no-data\.txt$', raw_file):
@@ -415,24 +479,28 @@ if __name__ == "__main__":
                         if no_data:
                             break
                         else:
-                            check_filenames(path, sub, ses, dtype, dtype_sfxs[dtype], dtype_exts[dtype], corrected)
+                            validate(check_filenames, path, sub, ses, dtype, dtype_sfxs[dtype], dtype_exts[dtype], corrected)
 
-    print("Verifying numbers of files in subdirectories in checked")
-    for sub in listdir(checked):
-        if isdir(join(checked, sub)):
-            for session_folder in listdir(join(checked, sub)):
-                if isdir(join(checked, sub, session_folder)):
+    report("Verifying numbers of files in subdirectories in checked")
+    for sub in tree.listdir(checked):
+        if tree.isdir(join(checked, sub)):
+            for session_folder in tree.listdir(join(checked, sub)):
+                if tree.isdir(join(checked, sub, session_folder)):
                     for datatype_folder in datatype_folders:
                         tasks = []
                         for task, vals in dd_dict.items():
-                            if vals[0] == datatype_folder:
+                            if vals.datatype == datatype_folder:
                                 tasks.append(task)
                         path = join(checked, sub, session_folder, datatype_folder)
-                        if isdir(path):
+                        if tree.isdir(path):
                             corrected = False
-                            for raw_file in listdir(path):
+                            for raw_file in tree.listdir(path):
                                 if re.match('^[Dd]eviation.*$', raw_file) or re.match('^no-data\.txt$', raw_file):
                                     corrected = True
                                     break
-                            check_number_of_files(path, datatype_folder, tasks, corrected)
-
+                            validate(check_number_of_files, path, datatype_folder, tasks, corrected, sub)
+    flush()
+    if pool is not None:
+        pool.shutdown()
+    eeg_headers.save()
+    eeg_signals.save()